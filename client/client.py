@@ -5,6 +5,7 @@ from PyQt5.QtWidgets import QApplication
 # from client_gui import ClientWindow
 from client_gui import ClientWindow
 from client_network import ClientNetwork
+from server_discovery import DiscoveryCache
 
 # 获取当前文件所在目录的父目录
 # current_dir = os.path.dirname(os.path.abspath(__file__))
@@ -15,7 +16,10 @@ from client_network import ClientNetwork
 class ClientApp:
     def __init__(self):
         self.gui = ClientWindow()
-        self.network = ClientNetwork("192.168.1.4", 8080, self.gui)
+        # 先连接上次成功连接的服务器，没有记录时使用局域网发现的服务器
+        cache = DiscoveryCache()
+        host, port = cache.last_server() or (None, None)
+        self.network = ClientNetwork(host, port, self.gui, cache)
         self.gui.network = self.network  # 建立反向引用
 
 
@@ -16,7 +16,6 @@ from PyQt5.QtWidgets import (
 )
 from PyQt5.QtGui import QIntValidator
 from datetime import datetime
-import time
 
 
 class MessageHandler(QObject):
@@ -25,6 +24,9 @@ class MessageHandler(QObject):
 
 class ClientWindow(QMainWindow):
     append_message_signal = pyqtSignal(str)
+    # 网络线程通过信号更新状态栏和当前服务器，控件只在界面线程中修改
+    status_signal = pyqtSignal(str)
+    server_label_signal = pyqtSignal(str)
 
     def __init__(self):
         super().__init__()
@@ -88,6 +90,8 @@ class ClientWindow(QMainWindow):
 
         # 连接信号
         self.append_message_signal.connect(self._append_message)
+        self.status_signal.connect(self.status_label.setText)
+        self.server_label_signal.connect(self.current_server_label.setText)
 
     # 处理来自网络的消息
     def _handle_network_message(self, message):
@@ -117,6 +121,8 @@ class ClientWindow(QMainWindow):
                 "timestamp", datetime.now().strftime("%Y-%m-%d %H:%M:%S")
             )
             content = message.get("content", "空消息")
+            if message.get("room"):
+                content = f"[房间 {message['room']}] {content}"
             # 处理网页用户显示
             if message.get("source") == "web":
                 display_name = f"🌐{nickname.split('/')[-1]}"
@@ -137,7 +143,10 @@ class ClientWindow(QMainWindow):
 
     def on_user_double_click(self, item):
         selected_user = item.text().split(" (")[0]
-        self.mode_btn.setText(f"私聊：{selected_user}")
+        if hasattr(self, "network"):
+            self.network.set_mode("private", selected_user)
+        else:
+            self.mode_btn.setText(f"私聊：{selected_user}")
 
     # 线程安全的消息追加方法
     def _append_message(self, text):
@@ -172,21 +181,37 @@ class ClientWindow(QMainWindow):
     def show_server_config_dialog(self):
         dialog = QDialog(self)
         dialog.setWindowTitle("服务器配置")
-        dialog.setFixedSize(300, 150)
+        dialog.setFixedSize(300, 260)
 
         layout = QVBoxLayout(dialog)
 
+        # 局域网内发现的服务器（含缓存），按负载从低到高排列，单击填入地址
+        servers = self.network.discovered or self.network.cache.servers()
+        server_list = QListWidget()
+        for server in servers:
+            item = QListWidgetItem(
+                f"{server['host']}:{server['port']}（{server['load']} 个连接）"
+            )
+            item.setData(Qt.UserRole, (server["host"], server["port"]))
+            server_list.addItem(item)
+        server_list.itemClicked.connect(self._on_server_item_clicked)
+
+        # 默认填入当前服务器，未连接时填入负载最低的服务器
+        host, port = self.network._host, self.network._port
+        if host is None and servers:
+            host, port = servers[0]["host"], servers[0]["port"]
+
         # 地址输入
         addr_layout = QHBoxLayout()
         addr_label = QLabel("服务器地址:")
-        self.addr_input = QLineEdit("192.168.1.4")
+        self.addr_input = QLineEdit(host or "")
         addr_layout.addWidget(addr_label)
         addr_layout.addWidget(self.addr_input)
 
         # 端口输入
         port_layout = QHBoxLayout()
         port_label = QLabel("端口号:")
-        self.port_input = QLineEdit("8080")
+        self.port_input = QLineEdit(str(port or ""))
         self.port_input.setValidator(QIntValidator(1, 65535))  # 限制端口范围
         port_layout.addWidget(port_label)
         port_layout.addWidget(self.port_input)
@@ -195,12 +220,19 @@ class ClientWindow(QMainWindow):
         confirm_btn = QPushButton("确认连接")
         confirm_btn.clicked.connect(lambda: self.apply_server_config(dialog))
 
+        layout.addWidget(QLabel("局域网内的服务器:"))
+        layout.addWidget(server_list)
         layout.addLayout(addr_layout)
         layout.addLayout(port_layout)
         layout.addWidget(confirm_btn)
 
         dialog.exec_()
 
+    def _on_server_item_clicked(self, item):
+        host, port = item.data(Qt.UserRole)
+        self.addr_input.setText(host)
+        self.port_input.setText(str(port))
+
     def apply_server_config(self, dialog):
         new_host = self.addr_input.text()
         new_port = self.port_input.text()
@@ -218,10 +250,3 @@ class ClientWindow(QMainWindow):
             self.connection_history.append(f"{new_host}:{new_port}")
         except Exception as e:
             self._show_status_message(f"连接失败: {str(e)}", "red")
-
-    def reconnect_to_server(self, new_host, new_port, retry=3):
-        for i in range(retry):
-            if self.connect_to_server():
-                return True
-            time.sleep(1)
-        raise ConnectionError(f"连接失败，已重试{retry}次")
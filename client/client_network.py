@@ -1,74 +1,134 @@
 import socket
 import json
 import threading
+import time
 from datetime import datetime
-from PyQt5.QtWidgets import QMessageBox, QListWidgetItem, QInputDialog
+from PyQt5.QtWidgets import QListWidgetItem, QInputDialog
 import os
 
+from reconnect import Backoff, OfflineOutbox
+from server_discovery import (
+    DISCOVERY_TIMEOUT,
+    DiscoveryCache,
+    discover_servers,
+    pick_server,
+)
+
+# 帧分隔符，与服务器保持一致
+FRAME_DELIMITER = b"<END_OF_JSON>"
+
 
 class ClientNetwork:
-    def __init__(self, host, port, gui):
+    # host 为 None 时不连接固定地址，直接使用局域网发现的服务器
+    def __init__(self, host, port, gui, cache=None):
 
         self.gui = gui
         self.host = host
         self.port = port
-        self.nickname = "未命名用户"
+        self._host = host
+        self._port = port
+        # 发送模式：public 群聊 / private 私聊 target_user / room 房间 current_room
         self.current_mode = "public"
         self.target_user = None
+        self.current_room = None
+        # 已加入的房间，重连时随握手一起恢复
+        self.rooms = set()
         self.client_socket = None
-        # self.client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-
-        # 连接服务器
-        try:
-            self.client_socket.connect((self.host, self.port))
-            self.gui.status_label.setText("状态：已连接")
-        except:
-            QMessageBox.critical(self.gui, "错误", "无法连接服务器")
-            return
+        self.send_lock = threading.Lock()
+
+        # 重连引擎：退避策略 + 离线发件箱
+        self.backoff = Backoff()
+        self.outbox = OfflineOutbox()
+        self.nickname = self.outbox.nickname or "未命名用户"
+        self.reconnect_lock = threading.Lock()
+        self.reconnecting = False
+        # 服务器排空时建议的重连延迟（秒），下一次重连前先等待这么久
+        self.reconnect_delay = 0
+        self.file_ack = threading.Event()
+        self.file_reject_reason = None
+
+        # 心跳：间隔由服务器在 welcome 中下发
+        self.heartbeat_interval = 15
+        self.last_received = time.monotonic()
 
         # 绑定事件
         self.gui.send_btn.clicked.connect(self.send_message)
         self.gui.file_btn.clicked.connect(self.send_file)
         self.gui.nickname_btn.clicked.connect(self.set_nickname)
+        self.gui.mode_btn.clicked.connect(self.switch_mode)
 
         self.gui.msg_handler.network_message.connect(self.handle_message)
 
-        # 启动接收线程
-        self.receive_thread = threading.Thread(target=self.receive_data, daemon=True)
-        self.receive_thread.start()
-
-        self.connect_to_server()
+        # 局域网发现与连接上次的服务器同时进行，结果写入缓存
+        self.cache = cache if cache is not None else DiscoveryCache()
+        self.discovered = []
+        self.discovery_done = threading.Event()
+        self.discovery_lock = threading.Lock()
+        self.discovering = False
+        self.start_discovery()
+
+        # 连接服务器，失败时在后台按退避策略重试
+        if self._host is None:
+            self.gui.append_message_signal.emit("[系统] 正在搜索局域网内的服务器")
+            self.reconnect_server()
+        elif not self.connect_to_server():
+            self.gui.append_message_signal.emit("[系统] 无法连接服务器，正在后台重试")
+            self.reconnect_server()
 
-    # 通用连接方法
+    # 通用连接方法：单次连接尝试，成功后补发离线消息
     def connect_to_server(self):
         try:
-            if self.client_socket:
-                # 关闭旧连接
+            # 关闭旧连接，先解除引用，旧接收线程退出时不会再触发重连
+            old_socket, self.client_socket = self.client_socket, None
+            if old_socket:
                 try:
-                    self.client_socket.shutdown(socket.SHUT_RDWR)
-                    self.client_socket.close()
-                except:
+                    old_socket.shutdown(socket.SHUT_RDWR)
+                    old_socket.close()
+                except OSError:
                     pass
             # 创建新连接
-            self.client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.client_socket.settimeout(10)
-            self.client_socket.connect((self._host, self._port))
-
-            # 发送初始握手包
-            self.client_socket.send(b"HELO")
-            ack = self.client_socket.recv(4)
-            if ack != b"ACK":
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.settimeout(10)
+            sock.connect((self._host, self._port))
+
+            # 发送握手包，携带会话信息以便服务器补发错过的消息
+            hello = {
+                "type": "hello",
+                "session_id": self.outbox.session_id,
+                "nickname": self.nickname,
+                "epoch": self.outbox.epoch,
+                "last_seq": self.outbox.last_seq,
+                "rooms": sorted(self.rooms),
+            }
+            sock.sendall(self._encode(hello))
+            welcome, buffer = self._read_frame(sock, b"")
+            if welcome.get("type") != "welcome":
                 raise ConnectionError("握手失败")
-
-            # 重启接收线程
-            if hasattr(self, "receive_thread"):
-                self.receive_thread.join(0.1)
-            self.receive_thread = threading.Thread(
-                target=self.receive_data, daemon=True
-            )
-            self.receive_thread.start()
-
-            self.gui.status_label.setText("状态：已连接")
+            sock.settimeout(None)
+
+            self._handle_welcome(welcome)
+            if self.host is None:
+                # 没有指定地址时用本机出口地址作为用户标识
+                self.host = sock.getsockname()[0]
+
+            # 在发送锁内发布新连接并补发离线消息：补发完成前其他线程的新消息不会插到前面，
+            # 否则服务器按最大 client_seq 去重，会把还没补发的消息当成重复丢掉
+            with self.send_lock:
+                self.client_socket = sock
+                # 重启接收线程
+                self.receive_thread = threading.Thread(
+                    target=self.receive_data, args=(sock, buffer), daemon=True
+                )
+                self.receive_thread.start()
+                self.heartbeat_thread = threading.Thread(
+                    target=self.send_heartbeats, args=(sock,), daemon=True
+                )
+                self.heartbeat_thread.start()
+                self.flush_outbox()
+            self.cache.remember(self._host, self._port)
+
+            self.gui.status_signal.emit("状态：已连接")
+            self.gui.server_label_signal.emit(f"当前服务器：{self._host}:{self._port}")
             return True
         except Exception as e:
             self.gui.append_message_signal.emit(f"[错误] 连接失败: {str(e)}")
@@ -76,26 +136,148 @@ class ClientNetwork:
 
     def reconnect_to_server(self, new_host, new_port):
         """重新连接到新服务器"""
+        old_host, old_port = self._host, self._port
         self._host = new_host
         self._port = new_port
 
-        # 保存旧socket引用
-        old_socket = self.client_socket
-
-        # 尝试连接新服务器
         if self.connect_to_server():
-            # 关闭旧连接
-            if old_socket:
-                try:
-                    old_socket.shutdown(socket.SHUT_RDWR)
-                    old_socket.close()
-                except:
-                    pass
             # 发送用户更新信息
             self.send_user_update()
         else:
+            self._host, self._port = old_host, old_port
             raise ConnectionError("无法连接到新服务器")
 
+    # 重新连接服务器：后台线程按指数退避 + 抖动重试，同一时间只有一个重连线程
+    def reconnect_server(self):
+        with self.reconnect_lock:
+            if self.reconnecting:
+                return
+            self.reconnecting = True
+        self.gui.status_signal.emit("状态：正在重连")
+        threading.Thread(target=self._reconnect_loop, daemon=True).start()
+
+    # 当前服务器连不上时先依次尝试发现的其他服务器，都失败后再退避并重新发现
+    def _reconnect_loop(self):
+        try:
+            delay, self.reconnect_delay = self.reconnect_delay, 0
+            if delay:
+                time.sleep(delay)
+            tried = set()
+            while self._host is None or not self.connect_to_server():
+                if self._host is not None:
+                    tried.add((self._host, self._port))
+                server = self.choose_discovered_server(tried)
+                if server is not None:
+                    self._host, self._port = server["host"], server["port"]
+                    self.gui.append_message_signal.emit(
+                        f"[系统] 发现服务器 {self._host}:{self._port}"
+                        f"（{server['load']} 个连接），正在连接"
+                    )
+                    continue
+                tried.clear()
+                delay = self.backoff.next_delay()
+                if self._host is None:
+                    self.gui.append_message_signal.emit(
+                        f"[系统] 未发现服务器，{delay:.1f} 秒后重新搜索"
+                    )
+                else:
+                    self.gui.append_message_signal.emit(
+                        f"[系统] {delay:.1f} 秒后重试连接 {self._host}:{self._port}"
+                    )
+                time.sleep(delay)
+                self.start_discovery()
+            self.backoff.reset()
+        finally:
+            with self.reconnect_lock:
+                self.reconnecting = False
+
+    # 在后台发现局域网内的服务器，同一时间只有一轮发现
+    def start_discovery(self):
+        with self.discovery_lock:
+            if self.discovering:
+                return
+            self.discovering = True
+            self.discovery_done.clear()
+        threading.Thread(target=self._run_discovery, daemon=True).start()
+
+    def _run_discovery(self):
+        try:
+            servers = discover_servers()
+            if servers:
+                self.cache.update(servers)
+            self.discovered = servers
+        finally:
+            with self.discovery_lock:
+                self.discovering = False
+            self.discovery_done.set()
+
+    # 等待本轮发现结束，选出负载最低且尚未尝试过的服务器；本轮没有结果时使用缓存
+    def choose_discovered_server(self, exclude=()):
+        self.discovery_done.wait(DISCOVERY_TIMEOUT + 1)
+        return pick_server(self.discovered or self.cache.servers(), exclude)
+
+    def _encode(self, message):
+        return json.dumps(message, ensure_ascii=False).encode("utf-8") + FRAME_DELIMITER
+
+    # 从socket读取一个完整帧，返回 (消息, 剩余缓冲)
+    def _read_frame(self, sock, buffer):
+        while FRAME_DELIMITER not in buffer:
+            data = sock.recv(4096)
+            if not data:
+                raise ConnectionError("连接已关闭")
+            buffer += data
+        frame, buffer = buffer.split(FRAME_DELIMITER, 1)
+        return json.loads(frame.decode("utf-8")), buffer
+
+    def _send_frame(self, message):
+        with self.send_lock:
+            self.client_socket.sendall(self._encode(message))
+
+    # 定期发送心跳；连续多个间隔没有收到任何数据则判定连接已失效
+    def send_heartbeats(self, sock):
+        self.last_received = time.monotonic()
+        while sock is self.client_socket:
+            time.sleep(self.heartbeat_interval)
+            if sock is not self.client_socket:
+                break
+            if time.monotonic() - self.last_received > self.heartbeat_interval * 3:
+                self.gui.append_message_signal.emit("[系统] 服务器无响应，正在重连")
+                try:
+                    # 关闭后接收线程会报错退出并触发重连
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+                break
+            try:
+                self._send_frame({"type": "ping"})
+            except (OSError, AttributeError):
+                break
+
+    def _handle_welcome(self, welcome):
+        self.heartbeat_interval = welcome.get(
+            "heartbeat_interval", self.heartbeat_interval
+        )
+        # 服务器已处理过的离线消息不再重发
+        self.outbox.ack(welcome.get("last_client_seq", 0))
+        if welcome.get("epoch") != self.outbox.epoch:
+            # 服务器已重启，旧序号失效，从当前位置重新开始
+            self.outbox.update_position(welcome.get("epoch"), welcome.get("seq"))
+
+    # 按顺序补发离线期间写入发件箱的消息；调用方需持有 send_lock
+    def flush_outbox(self):
+        pending = self.outbox.snapshot()
+        if not pending:
+            return
+        try:
+            for message in pending:
+                self.client_socket.sendall(self._encode(message))
+            self.gui.append_message_signal.emit(
+                f"[系统] 已补发 {len(pending)} 条离线消息"
+            )
+        except OSError as e:
+            self.gui.append_message_signal.emit(f"[错误] 补发离线消息失败: {str(e)}")
+            self.reconnect_server()
+
     def send_user_update(self):
         """连接成功后更新用户信息"""
         update_data = {
@@ -104,19 +286,24 @@ class ClientNetwork:
             "ip": self.host,
             "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
         }
-        self.client_socket.send(json.dumps(update_data).encode())
+        self._send_frame(update_data)
 
     def set_nickname(self):
         nickname, ok = QInputDialog.getText(self.gui, "设置昵称", "请输入昵称:")
         if ok and nickname:
             self.nickname = nickname
+            self.outbox.set_nickname(nickname)
             update_data = {
                 "type": "user_update",
                 "nickname": nickname,
                 "ip": self.host,  # 需要包含用户IP用于标识
                 "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
             }
-            self.client_socket.send(json.dumps(update_data).encode())
+            try:
+                self._send_frame(update_data)
+            except (OSError, AttributeError):
+                # 未连接时昵称会随下一次握手同步给服务器
+                pass
             # self.send_system_message({"type": "user_update", "nickname": nickname})
 
     def send_message(self):
@@ -127,28 +314,30 @@ class ClientNetwork:
             self.gui._show_status_message("⚠️ 消息内容不能为空！")  # 使用状态栏提示
             self.gui.message_input.clear()
             return
-        if not self.client_socket or not self._is_connected():
-            self.gui.append_message_signal.emit("[系统] 正在尝试重新连接...")
-            self.connect_to_server()
-        try:
-
-            message_data = {
-                "type": "message",
-                "sender_ip": self.host,
-                "nickname": self.nickname,
-                "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                "content": message,
-                "receiver": (
-                    "all" if self.current_mode == "public" else self.target_user
-                ),
-            }
-            # 本地立即显示逻辑
-            self.show_local_message(message_data)
+        message_data = {
+            "type": "message",
+            "sender_ip": self.host,
+            "nickname": self.nickname,
+            "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "content": message,
+            "receiver": ("all" if self.current_mode != "private" else self.target_user),
+        }
+        if self.current_mode == "room":
+            message_data["room"] = self.current_room
+        # 先写入离线发件箱，收到服务器确认后才删除
+        self.outbox.put(message_data)
+        # 本地立即显示逻辑
+        self.show_local_message(message_data)
 
-            self.client_socket.send(json.dumps(message_data).encode("utf-8"))
-        except Exception as e:
-            self.gui.append_message_signal.emit(f"[错误] 发送失败: {str(e)}")
+        if not self.client_socket or not self._is_connected():
+            self.gui.append_message_signal.emit("[系统] 未连接，消息将在重连后发送")
             self.reconnect_server()
+        else:
+            try:
+                self._send_frame(message_data)
+            except Exception as e:
+                self.gui.append_message_signal.emit(f"[错误] 发送失败: {str(e)}")
+                self.reconnect_server()
         self.gui.message_input.clear()
 
     # 添加连接状态的判断
@@ -184,31 +373,40 @@ class ClientNetwork:
                 "file_name": os.path.basename(file_path),
                 "file_size": os.path.getsize(file_path),
                 "receiver": (
-                    "all" if self.current_mode == "public" else self.target_user
+                    "all" if self.current_mode != "private" else self.target_user
                 ),
             }
 
-            # 添加结束标记
-            meta_data = json.dumps(file_data) + "<END_OF_JSON>"
-            self.client_socket.send(meta_data.encode())
-
-            # 等待服务器确认
-            ack = self.client_socket.recv(3)  # 接收简单的ACK确认
-            if ack != b"ACK":
-                raise Exception("服务器未确认接收")
-
-            # 发送文件内容（分块发送）
-            with open(file_path, "rb") as f:
-                total_sent = 0
-                while total_sent < file_data["file_size"]:
-                    chunk = f.read(4096)  # 增大块大小到4KB
-                    if not chunk:
-                        break
-                    self.client_socket.sendall(chunk)  # 使用sendall确保完整发送
-                    total_sent += len(chunk)
-                    # 更新发送进度（可选）
-                    progress = int((total_sent / file_data["file_size"]) * 100)
-                    self.gui.append_message_signal.emit(f"[进度] 已发送 {progress}%")
+            # 整个上传期间持有发送锁，心跳等其他帧不会插进文件内容中间
+            with self.send_lock:
+                # 等待服务器确认（确认帧由接收线程读取）
+                self.file_ack.clear()
+                self.client_socket.sendall(self._encode(file_data))
+                if not self.file_ack.wait(10):
+                    raise Exception("服务器未确认接收")
+                if self.file_reject_reason:
+                    # 服务器在传输开始前拒绝，连接仍然可用，无需重连
+                    self.gui.append_message_signal.emit(
+                        f"[错误] 服务器拒绝接收文件: {self.file_reject_reason}"
+                    )
+                    return
+
+                # 发送文件内容（分块发送）
+                with open(file_path, "rb") as f:
+                    total_sent = 0
+                    while total_sent < file_data["file_size"]:
+                        chunk = f.read(4096)  # 增大块大小到4KB
+                        if not chunk:
+                            break
+                        self.client_socket.sendall(chunk)  # 使用sendall确保完整发送
+                        total_sent += len(chunk)
+                        # 服务器接收文件期间不回复心跳，上传有进展即视为连接存活
+                        self.last_received = time.monotonic()
+                        # 更新发送进度（可选）
+                        progress = int((total_sent / file_data["file_size"]) * 100)
+                        self.gui.append_message_signal.emit(
+                            f"[进度] 已发送 {progress}%"
+                        )
 
             self.gui.append_message_signal.emit(
                 f"[成功] 文件 {file_data['file_name']} 已发送"
@@ -219,41 +417,76 @@ class ClientNetwork:
             # 重建连接
             self.reconnect_server()
 
-    # 重新连接服务器
-    def reconnect_server(self):
+    def receive_data(self, sock, buffer):
         try:
-            self.client_socket.close()
-            self.client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.client_socket.connect((self.host, self.port))
-            self.gui.status_label.setText("状态：已重新连接")
+            while True:
+                message, buffer = self._read_frame(sock, buffer)
+                self.last_received = time.monotonic()
+                self.dispatch_frame(message)
         except Exception as e:
+            # 连接已被替换（例如切换服务器）时静默退出
+            if sock is not self.client_socket:
+                return
+            error_msg = f"连接错误: {str(e)}"
+            self.gui.append_message_signal.emit(f"[系统] {error_msg}")
+            self.reconnect_server()
+
+    # 处理协议层的帧，聊天相关的消息交给界面线程
+    def dispatch_frame(self, message):
+        msg_type = message.get("type")
+        if msg_type == "pong":
+            return
+        elif msg_type == "ack":
+            self.outbox.ack(message["client_seq"])
+        elif msg_type == "reconnect":
+            # 服务器即将重启：按建议的延迟重连，未确认的消息留在发件箱中稍后重发
+            self.reconnect_delay = message.get("delay", 0)
             self.gui.append_message_signal.emit(
-                f"[严重错误] 无法重新连接服务器: {str(e)}"
+                f"[系统] {message.get('reason', '服务器要求重连')}，"
+                f"{self.reconnect_delay:.1f} 秒后重新连接"
             )
-
-    def receive_data(self):
-        while True:
-            try:
-                data = self.client_socket.recv(1024)
-                if not data:
-                    break
-
-                # 处理不同类型的数据
-                if data.startswith(b"{"):
-                    message = json.loads(data.decode())
-                    self.gui.msg_handler.network_message.emit(message)
-                    # self.handle_message(message)
-                else:
-                    self.handle_file(data)
-
-                # self.gui.msg_handler.network_message.emit(message)
-
-            except Exception as e:
-                # QMessageBox.critical(self.gui, "错误", f"连接错误: {str(e)}")
-                # self.gui.append_message_signal.emit(f"[系统] 连接异常: {str(e)}")
-                error_msg = f"连接错误: {str(e)}"
-                self.gui.append_message_signal.emit(f"[系统] {error_msg}")
-                break
+            sock = self.client_socket
+            if sock is not None:
+                try:
+                    # 关闭后接收线程会报错退出并触发重连
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+        elif msg_type in ("file_ack", "file_reject"):
+            self.file_reject_reason = message.get("reason")
+            self.file_ack.set()
+        elif msg_type == "room_joined":
+            self.gui.append_message_signal.emit(
+                f"[系统] 已加入房间 {message['room']}（{message['members']} 人）"
+            )
+        elif msg_type == "room_left":
+            self.gui.append_message_signal.emit(f"[系统] 已离开房间 {message['room']}")
+        elif msg_type == "mailbox":
+            messages = message.get("messages", [])
+            self.gui.append_message_signal.emit(
+                f"[系统] 收到 {len(messages)} 条离线私聊消息"
+            )
+            for offline in messages:
+                self.gui.msg_handler.network_message.emit(offline)
+        elif msg_type == "room_history":
+            # 加入房间时的近期历史，序号可能早于当前位置，直接显示
+            for past in message.get("messages", []):
+                self.gui.msg_handler.network_message.emit(past)
+        elif msg_type == "resume":
+            for missed in message.get("messages", []):
+                self.dispatch_frame(missed)
+            if not message.get("complete", True):
+                self.gui.append_message_signal.emit(
+                    "[系统] 离线时间过长，部分消息已无法补发"
+                )
+        else:
+            seq = message.get("seq")
+            if seq is not None:
+                # 丢弃重复消息，并记录最新序号用于断线续传
+                if self.outbox.is_duplicate(seq):
+                    return
+                self.outbox.update_position(self.outbox.epoch, seq)
+            self.gui.msg_handler.network_message.emit(message)
 
     def handle_message(self, message):
         try:
@@ -326,6 +559,57 @@ class ClientNetwork:
         # 文件处理逻辑
         pass
 
+    # 切换发送模式：群聊、已加入的房间、加入新房间或离开当前房间
+    def switch_mode(self):
+        options = ["群聊"] + [f"房间：{room}" for room in sorted(self.rooms)]
+        options.append("加入新房间...")
+        if self.current_mode == "room":
+            options.append(f"离开房间：{self.current_room}")
+        choice, ok = QInputDialog.getItem(
+            self.gui, "切换模式", "发送到:", options, 0, False
+        )
+        if not ok:
+            return
+        if choice == "群聊":
+            self.set_mode("public")
+        elif choice == "加入新房间...":
+            room, ok = QInputDialog.getText(self.gui, "加入房间", "房间名:")
+            if ok and room.strip():
+                self.join_room(room.strip())
+        elif choice.startswith("离开房间："):
+            self.leave_room(self.current_room)
+        else:
+            self.set_mode("room", choice.split("：", 1)[1])
+
+    def set_mode(self, mode, target=None):
+        self.current_mode = mode
+        if mode == "private":
+            self.target_user = target
+            self.gui.mode_btn.setText(f"私聊：{target}")
+        elif mode == "room":
+            self.current_room = target
+            self.gui.mode_btn.setText(f"房间：{target}")
+        else:
+            self.gui.mode_btn.setText("群聊模式")
+
+    def join_room(self, room):
+        self.rooms.add(room)
+        self.set_mode("room", room)
+        try:
+            self._send_frame({"type": "join", "room": room})
+        except (OSError, AttributeError):
+            # 未连接时房间会随下一次握手恢复
+            pass
+
+    def leave_room(self, room):
+        self.rooms.discard(room)
+        if self.current_room == room:
+            self.set_mode("public")
+        try:
+            self._send_frame({"type": "leave", "room": room})
+        except (OSError, AttributeError):
+            pass
+
     # 发送刷新用户列表请求
     def send_refresh_request(self):
         request = {
@@ -334,7 +618,7 @@ class ClientNetwork:
             "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
         }
         try:
-            self.client_socket.send(json.dumps(request).encode())
+            self._send_frame(request)
             print("[DEBUG] 已发送用户列表刷新请求")
         except Exception as e:
             print(f"发送刷新请求失败: {str(e)}")
@@ -0,0 +1,115 @@
+import json
+import os
+import random
+import threading
+import uuid
+
+from state_file import save_json
+
+
+class Backoff:
+    """指数退避 + 全抖动：服务器重启时避免所有客户端同时重连"""
+
+    def __init__(self, base=0.5, cap=30.0, factor=2.0):
+        self.base = base
+        self.cap = cap
+        self.factor = factor
+        self.attempt = 0
+
+    def next_delay(self):
+        ceiling = min(self.cap, self.base * (self.factor**self.attempt))
+        self.attempt += 1
+        return random.uniform(0, ceiling)
+
+    def reset(self):
+        self.attempt = 0
+
+
+class OfflineOutbox:
+    """持久化的离线发件箱，同时保存会话标识、昵称和已收到的最大序号
+
+    未被服务器确认的消息都留在发件箱中，重连后按顺序重发；
+    服务器根据 session_id + client_seq 丢弃重复消息。
+    """
+
+    def __init__(self, path="offline_outbox.json"):
+        self.path = path
+        self.lock = threading.Lock()
+        self.session_id = uuid.uuid4().hex
+        # 上次设置的昵称，握手时带上，服务器据此下发离线信箱
+        self.nickname = None
+        self.next_client_seq = 1
+        self.epoch = None
+        self.last_seq = None
+        self.pending = []
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+            self.session_id = state["session_id"]
+            self.nickname = state.get("nickname")
+            self.next_client_seq = state["next_client_seq"]
+            self.epoch = state.get("epoch")
+            self.last_seq = state.get("last_seq")
+            self.pending = state.get("pending", [])
+        except (OSError, ValueError, KeyError) as e:
+            print(f"读取离线发件箱失败: {str(e)}")
+
+    def _save(self):
+        state = {
+            "session_id": self.session_id,
+            "nickname": self.nickname,
+            "next_client_seq": self.next_client_seq,
+            "epoch": self.epoch,
+            "last_seq": self.last_seq,
+            "pending": self.pending,
+        }
+        save_json(self.path, state)
+
+    def set_nickname(self, nickname):
+        with self.lock:
+            self.nickname = nickname
+            self._save()
+
+    # 为消息分配客户端序号并写入发件箱
+    def put(self, message):
+        with self.lock:
+            message["client_seq"] = self.next_client_seq
+            self.next_client_seq += 1
+            self.pending.append(message)
+            self._save()
+        return message
+
+    # 服务器确认了 client_seq 及之前的所有消息
+    def ack(self, client_seq):
+        with self.lock:
+            remaining = [m for m in self.pending if m["client_seq"] > client_seq]
+            if len(remaining) != len(self.pending):
+                self.pending = remaining
+                self._save()
+
+    def snapshot(self):
+        with self.lock:
+            return list(self.pending)
+
+    # 记录服务器纪元和已收到的最大序号，纪元变化说明服务器已重启
+    def update_position(self, epoch, seq):
+        with self.lock:
+            if epoch != self.epoch:
+                self.epoch = epoch
+                self.last_seq = seq
+                self._save()
+            elif seq is not None and (self.last_seq is None or seq > self.last_seq):
+                self.last_seq = seq
+
+    def is_duplicate(self, seq):
+        with self.lock:
+            return self.last_seq is not None and seq <= self.last_seq
+
+    def flush(self):
+        with self.lock:
+            self._save()
@@ -0,0 +1,161 @@
+import json
+import os
+import socket
+import threading
+import time
+
+from state_file import save_json
+
+# 与服务器 discovery.py 保持一致
+DISCOVERY_GROUP = "239.255.80.80"
+DISCOVERY_PORT = 8082
+PROTOCOL_VERSION = 1
+MAX_DATAGRAM = 1024
+# 等待服务器回复的时间（秒）
+DISCOVERY_TIMEOUT = 1.0
+# 缓存中超过该时间（秒）没有再被发现的服务器不再作为候选
+CACHE_TTL = 24 * 3600
+
+
+# 向组播组和广播地址发送探测，收集一段时间内的回复
+# 返回 [{"host", "port", "web_port", "load", "capabilities"}]，按负载从低到高排序
+def discover_servers(
+    timeout=DISCOVERY_TIMEOUT,
+    port=DISCOVERY_PORT,
+    group=DISCOVERY_GROUP,
+    interface="0.0.0.0",
+    broadcast=True,
+):
+    probe = json.dumps({"type": "discover", "version": PROTOCOL_VERSION}).encode(
+        "utf-8"
+    )
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 1)
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+        sock.setsockopt(
+            socket.IPPROTO_IP, socket.IP_MULTICAST_IF, socket.inet_aton(interface)
+        )
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        targets = [group]
+        if broadcast:
+            targets.append("255.255.255.255")
+        sent = False
+        for target in targets:
+            try:
+                sock.sendto(probe, (target, port))
+                sent = True
+            except OSError:
+                # 没有组播路由或不允许广播时，另一种方式可能仍然可用
+                pass
+        if not sent:
+            return []
+
+        # 同一台服务器可能同时收到组播和广播探测，并从不同地址回复；
+        # 按 epoch（没有时按地址）和端口去重，保留最先到达的回复
+        found = {}
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            sock.settimeout(remaining)
+            try:
+                data, addr = sock.recvfrom(MAX_DATAGRAM)
+            except socket.timeout:
+                break
+            except OSError:
+                continue
+            try:
+                info = json.loads(data.decode("utf-8"))
+                if info.get("type") != "server":
+                    continue
+                server = {
+                    "host": info.get("host") or addr[0],
+                    "port": int(info["port"]),
+                    "web_port": info.get("web_port"),
+                    "load": int(info.get("load", 0)),
+                    "capabilities": list(info.get("capabilities", [])),
+                }
+            except (ValueError, KeyError, TypeError, AttributeError):
+                continue
+            found.setdefault(
+                (info.get("epoch") or server["host"], server["port"]), server
+            )
+        return sorted(found.values(), key=lambda server: server["load"])
+    finally:
+        sock.close()
+
+
+class DiscoveryCache:
+    """持久化的服务器缓存：上次成功连接的服务器，以及最近发现的服务器列表
+
+    启动时先连接上次的服务器，同时在后台重新发现；
+    上次的服务器不可用时，从发现结果（或缓存）中选负载最低的一台。
+    """
+
+    def __init__(self, path="server_cache.json"):
+        self.path = path
+        self.lock = threading.Lock()
+        self.last = None
+        self.known = {}
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+            if state.get("last"):
+                host, port = state["last"]
+                self.last = (host, int(port))
+            now = time.time()
+            for server in state.get("servers", []):
+                if now - server.get("seen", 0) <= CACHE_TTL:
+                    self.known[(server["host"], server["port"])] = server
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            print(f"读取服务器缓存失败: {str(e)}")
+
+    # 先写临时文件再替换，避免写到一半崩溃导致文件损坏
+    def _save(self):
+        state = {"last": self.last, "servers": list(self.known.values())}
+        try:
+            save_json(self.path, state)
+        except OSError as e:
+            print(f"保存服务器缓存失败: {str(e)}")
+
+    # 上次成功连接的服务器 (host, port)，没有时返回 None
+    def last_server(self):
+        with self.lock:
+            return self.last
+
+    def remember(self, host, port):
+        with self.lock:
+            if self.last == (host, port):
+                return
+            self.last = (host, port)
+            self._save()
+
+    # 合并一轮发现结果
+    def update(self, servers):
+        now = time.time()
+        with self.lock:
+            for server in servers:
+                self.known[(server["host"], server["port"])] = dict(server, seen=now)
+            self._save()
+
+    # 缓存的服务器，按负载从低到高排序
+    def servers(self):
+        with self.lock:
+            return sorted(self.known.values(), key=lambda server: server["load"])
+
+
+# 从候选中选负载最低的服务器，exclude 中的 (host, port) 不参与选择
+def pick_server(servers, exclude=()):
+    candidates = [
+        server for server in servers if (server["host"], server["port"]) not in exclude
+    ]
+    if not candidates:
+        return None
+    return min(candidates, key=lambda server: server["load"])
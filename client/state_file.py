@@ -0,0 +1,10 @@
+import json
+import os
+
+
+# 先写临时文件再替换，避免写到一半崩溃导致文件损坏；写入失败时抛出 OSError
+def save_json(path, state):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
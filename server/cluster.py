@@ -0,0 +1,339 @@
+"""多进程模式：多个工作进程通过 SO_REUSEPORT 共享监听端口
+
+主进程运行本地消息总线（Unix 域套接字），负责：
+- 为所有聊天消息分配全局序号，保证各工作进程投递顺序一致、断线续传可跨进程；
+- 按 session_id + client_seq 去重，客户端重连到其他进程后重发的离线消息不会重复；
+- 汇总各工作进程的在线用户并同步给所有进程。
+
+仅支持 Linux（需要 SO_REUSEPORT 和 AF_UNIX）：
+    python server/cluster.py --workers 4 --port 8080
+
+其余参数和配置文件与 server.py 相同。接收文件目录、离线信箱、流量录制、性能报告和
+日志文件按工作进程拆开（见 worker_config），文件配额在各进程间平分。
+"""
+
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import socket
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+from config import LOG_OPTIONS, build_parser, resolve_config
+from log_pipeline import setup_logging, shutdown_logging
+
+# 总线帧由两行组成：信封（小 JSON，总线进程会解析）+ 消息体（原样转发，不解析）
+BUS_MAX_SESSIONS = 100000
+# 每个工作进程的待发送帧上限，超过说明该进程已停止读取总线
+BUS_QUEUE_SIZE = 10000
+
+logger = logging.getLogger("im.cluster")
+
+
+def _encode_frame(envelope, body=b""):
+    return json.dumps(envelope).encode("utf-8") + b"\n" + body + b"\n"
+
+
+def _write_frame(sock, lock, envelope, body=b""):
+    data = _encode_frame(envelope, body)
+    with lock:
+        sock.sendall(data)
+
+
+class _FrameReader:
+    def __init__(self, sock):
+        self.file = sock.makefile("rb")
+
+    def read(self):
+        envelope = self.file.readline()
+        body = self.file.readline()
+        if not envelope or not body:
+            raise ConnectionError("总线连接已关闭")
+        return json.loads(envelope), body[:-1]
+
+
+class BusHub:
+    """运行在主进程中的本地消息总线"""
+
+    def __init__(self, path):
+        self.path = path
+        self.epoch = f"{int(time.time() * 1000):x}"
+        self.seq = 0
+        self.seq_lock = threading.Lock()
+        self.sessions = OrderedDict()  # {session_id: last_client_seq}
+        self.workers = {}  # {worker_id: (socket, 发送队列)}
+        self.presence = {}  # {worker_id: [用户...]}
+        self.lock = threading.Lock()
+
+        if os.path.exists(path):
+            os.unlink(path)
+        self.server_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server_socket.bind(path)
+        self.server_socket.listen(64)
+        threading.Thread(target=self.accept_workers, daemon=True).start()
+
+    def accept_workers(self):
+        while True:
+            sock, _ = self.server_socket.accept()
+            threading.Thread(
+                target=self.handle_worker, args=(sock,), daemon=True
+            ).start()
+
+    def handle_worker(self, sock):
+        reader = _FrameReader(sock)
+        # 每个工作进程一个发送队列和写线程，一个进程卡住不会阻塞其他进程
+        outbound = queue.Queue(maxsize=BUS_QUEUE_SIZE)
+        threading.Thread(
+            target=self.write_worker, args=(sock, outbound), daemon=True
+        ).start()
+        worker_id = None
+        try:
+            envelope, _ = reader.read()
+            worker_id = envelope["worker_id"]
+            outbound.put(_encode_frame({"type": "hub_hello", "epoch": self.epoch}))
+            with self.lock:
+                self.workers[worker_id] = (sock, outbound)
+            self.send_presence(outbound)
+
+            while True:
+                envelope, body = reader.read()
+                if envelope["type"] == "publish":
+                    self.publish(envelope, body)
+                elif envelope["type"] == "presence":
+                    with self.lock:
+                        self.presence[worker_id] = envelope["users"]
+                    self.broadcast_presence()
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning("总线连接断开: 工作进程 %s: %s", worker_id, e)
+        finally:
+            with self.lock:
+                self.workers.pop(worker_id, None)
+                self.presence.pop(worker_id, None)
+            try:
+                outbound.put_nowait(None)
+            except queue.Full:
+                pass
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            sock.close()
+            self.broadcast_presence()
+
+    def write_worker(self, sock, outbound):
+        while True:
+            data = outbound.get()
+            if data is None:
+                break
+            try:
+                sock.sendall(data)
+            except OSError:
+                break
+
+    # 去重并分配全局序号，再转发给所有工作进程（包括发送方自己）
+    def publish(self, envelope, body):
+        session_id = envelope.get("session_id")
+        client_seq = envelope.get("client_seq")
+        with self.seq_lock:
+            if session_id and client_seq is not None:
+                if client_seq <= self.sessions.get(session_id, 0):
+                    return
+                self.sessions[session_id] = client_seq
+                self.sessions.move_to_end(session_id)
+                while len(self.sessions) > BUS_MAX_SESSIONS:
+                    self.sessions.popitem(last=False)
+            self.seq += 1
+            # 在序号锁内入队（不阻塞），保证所有进程收到的顺序与序号一致
+            self._send_all(_encode_frame({"type": "message", "seq": self.seq}, body))
+
+    def _send_all(self, data):
+        with self.lock:
+            workers = list(self.workers.items())
+        for worker_id, (sock, outbound) in workers:
+            try:
+                outbound.put_nowait(data)
+            except queue.Full:
+                # 断开后该进程与总线失联会自行退出，由主进程重启
+                with self.lock:
+                    if self.workers.get(worker_id, (None,))[0] is not sock:
+                        continue
+                    del self.workers[worker_id]
+                logger.warning("工作进程 %s 的总线发送队列已满，断开连接", worker_id)
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+
+    def send_presence(self, outbound):
+        with self.lock:
+            presence = dict(self.presence)
+        outbound.put(_encode_frame({"type": "presence", "workers": presence}))
+
+    def broadcast_presence(self):
+        with self.lock:
+            presence = dict(self.presence)
+        self._send_all(_encode_frame({"type": "presence", "workers": presence}))
+
+
+class BusClient:
+    """工作进程一侧的总线连接，由 ServerNetwork 通过 bus 参数使用"""
+
+    def __init__(self, path, worker_id):
+        self.worker_id = str(worker_id)
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(path)
+        self.send_lock = threading.Lock()
+        self.reader = _FrameReader(self.sock)
+        _write_frame(self.sock, self.send_lock, {"worker_id": self.worker_id})
+        hello, _ = self.reader.read()
+        self.epoch = hello["epoch"]
+        self.network = None
+
+    def attach(self, network):
+        self.network = network
+        threading.Thread(target=self.receive, daemon=True).start()
+
+    def publish(self, message, session_id=None):
+        body = json.dumps(message, ensure_ascii=False).encode("utf-8")
+        envelope = {
+            "type": "publish",
+            "session_id": session_id,
+            "client_seq": message.get("client_seq"),
+        }
+        _write_frame(self.sock, self.send_lock, envelope, body)
+
+    def publish_presence(self, users):
+        _write_frame(self.sock, self.send_lock, {"type": "presence", "users": users})
+
+    def receive(self):
+        while True:
+            try:
+                envelope, body = self.reader.read()
+            except (OSError, ValueError) as e:
+                # 总线断开后本进程的消息无法再与其他进程同步，直接退出由主进程重启
+                logger.error("工作进程 %s 与总线断开: %s", self.worker_id, e)
+                os._exit(1)
+            try:
+                self.handle(envelope, body)
+            except Exception:
+                # 单条消息处理失败不能让接收线程退出，否则本进程再也收不到消息
+                logger.exception("工作进程 %s 处理总线消息失败", self.worker_id)
+
+    def handle(self, envelope, body):
+        if envelope["type"] == "message":
+            message = json.loads(body.decode("utf-8"))
+            self.network.deliver_message(message, seq=envelope["seq"])
+        elif envelope["type"] == "presence":
+            remote_users = [
+                user
+                for worker_id, users in envelope["workers"].items()
+                if worker_id != self.worker_id
+                for user in users
+            ]
+            self.network.update_remote_users(remote_users)
+
+
+# mailboxes.jsonl.gz -> mailboxes.worker0.jsonl.gz
+def _worker_path(path, worker_id):
+    directory, name = os.path.split(path)
+    stem, dot, suffix = name.partition(".")
+    return os.path.join(directory, f"{stem}.worker{worker_id}{dot}{suffix}")
+
+
+# 各工作进程各自持有 FileStore、信箱等，不能共用同一个目录或文件
+def worker_config(config, worker_id, workers):
+    config = dict(config)
+    config["files_dir"] = os.path.join(config["files_dir"], f"worker{worker_id}")
+    config["files_quota"] = config["files_quota"] // workers
+    config["profile_dir"] = os.path.join(config["profile_dir"], f"worker{worker_id}")
+    for name in ("mailbox_path", "capture_path", "log_file"):
+        if config[name]:
+            config[name] = _worker_path(config[name], worker_id)
+    # 局域网发现只需要一个进程应答
+    if worker_id != 0:
+        config["discovery_port"] = 0
+    return config
+
+
+def worker_main(config, hub_path, worker_id):
+    from server import serve, start_server
+
+    bus = BusClient(hub_path, worker_id)
+    network, _ = start_server(config, bus=bus, reuse_port=True)
+    serve(network)
+
+
+def run_cluster(config, workers):
+    if not hasattr(socket, "SO_REUSEPORT") or not hasattr(socket, "AF_UNIX"):
+        raise RuntimeError("集群模式需要 SO_REUSEPORT 和 Unix 域套接字（Linux）")
+
+    hub_path = os.path.join(tempfile.mkdtemp(prefix="im_bus_"), "bus.sock")
+    BusHub(hub_path)
+    logger.info(
+        "集群已启动：%d 个工作进程共享 %s:%s，总线 %s",
+        workers,
+        config["host"],
+        config["port"],
+        hub_path,
+    )
+
+    processes = {}
+
+    def spawn(worker_id):
+        process = multiprocessing.Process(
+            target=worker_main,
+            args=(worker_config(config, worker_id, workers), hub_path, worker_id),
+            daemon=True,
+        )
+        process.start()
+        processes[worker_id] = process
+
+    for worker_id in range(workers):
+        spawn(worker_id)
+
+    # 工作进程异常退出时自动重启；Ctrl+C 或 SIGTERM 时停止整个集群
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+    try:
+        while not stop.wait(1):
+            for worker_id, process in list(processes.items()):
+                if not process.is_alive():
+                    logger.warning(
+                        "工作进程 %s 已退出（%s），正在重启",
+                        worker_id,
+                        process.exitcode,
+                    )
+                    spawn(worker_id)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        # SIGTERM 让工作进程先排空，超时仍未退出的才被强制结束
+        for process in processes.values():
+            process.terminate()
+        deadline = time.monotonic() + config["drain_timeout"] + 5
+        for process in processes.values():
+            process.join(max(0, deadline - time.monotonic()))
+            if process.is_alive():
+                process.kill()
+        shutdown_logging()
+
+
+if __name__ == "__main__":
+    parser = build_parser("多进程即时通讯服务器")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count(),
+        help="工作进程数，默认等于CPU核数",
+    )
+    args = parser.parse_args()
+    config = resolve_config(args)
+    if config["handoff_path"]:
+        parser.error("集群模式不支持热重启（--handoff-path）")
+    setup_logging(*(config[name] for name in LOG_OPTIONS))
+    run_cluster(config, args.workers)
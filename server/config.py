@@ -0,0 +1,105 @@
+"""服务器配置：默认值 < 配置文件（JSON） < 命令行参数
+
+配置文件示例（server.json）：
+    {
+        "port": 8080,
+        "web_port": 8081,
+        "files_dir": "/var/lib/im/received_files",
+        "idle_timeout": 60
+    }
+"""
+
+import argparse
+import json
+
+from discovery import DISCOVERY_GROUP, DISCOVERY_PORT
+from file_store import DEFAULT_QUOTA
+from offline_mailbox import MAILBOX_TTL, MAX_MESSAGES_PER_USER, MAX_TOTAL_BYTES
+from server_network import (
+    DRAIN_TIMEOUT,
+    HEARTBEAT_INTERVAL,
+    HISTORY_SIZE,
+    IDLE_TIMEOUT,
+    OUTBOUND_QUEUE_SIZE,
+    RECONNECT_WINDOW,
+)
+
+# 配置项、默认值和说明；类型取自默认值，默认值为 None 的按字符串处理
+OPTIONS = {
+    "host": ("0.0.0.0", "聊天端口监听地址"),
+    "port": (8080, "聊天端口"),
+    "web_host": ("0.0.0.0", "网页/管理端口监听地址"),
+    "web_port": (8081, "网页/管理端口"),
+    "admin_token": (None, "管理接口令牌，未设置时只允许本机访问"),
+    "files_dir": ("received_files", "接收文件的保存目录"),
+    "files_quota": (DEFAULT_QUOTA, "接收文件目录的配额（字节）"),
+    "files_max_age": (0, "接收文件多久未被访问后删除（秒），0 表示不过期"),
+    "profile_dir": ("profiles", "性能分析报告目录"),
+    "capture_path": (None, "流量录制文件，未设置时不录制"),
+    "capture_anonymize": (False, "录制时匿名化昵称和消息内容"),
+    "history_size": (HISTORY_SIZE, "断线续传的历史消息数量"),
+    "heartbeat_interval": (HEARTBEAT_INTERVAL, "客户端心跳间隔（秒）"),
+    "idle_timeout": (IDLE_TIMEOUT, "无数据超时断开（秒）"),
+    "outbound_queue_size": (OUTBOUND_QUEUE_SIZE, "每个连接的发送队列长度"),
+    "reconnect_window": (RECONNECT_WINDOW, "排空时建议客户端重连的随机延迟上限（秒）"),
+    "drain_timeout": (DRAIN_TIMEOUT, "排空或热重启时等待发送队列写完的最长时间（秒）"),
+    "handoff_path": (None, "热重启交接用的 Unix socket 路径，未设置时不支持热重启"),
+    "handoff_connections": (False, "热重启时连同已建立的连接一起交给新进程"),
+    "discovery_port": (DISCOVERY_PORT, "局域网发现的 UDP 端口，0 表示不应答发现探测"),
+    "discovery_group": (DISCOVERY_GROUP, "局域网发现的组播地址，留空时只应答广播"),
+    "discovery_interface": ("0.0.0.0", "加入组播组使用的本机网卡地址"),
+    "mailbox_path": ("mailboxes.jsonl.gz", "离线信箱持久化文件，留空时只保存在内存中"),
+    "mailbox_ttl": (MAILBOX_TTL, "离线消息保留时间（秒）"),
+    "mailbox_max_messages": (MAX_MESSAGES_PER_USER, "每个用户最多保留的离线消息数"),
+    "mailbox_max_bytes": (MAX_TOTAL_BYTES, "所有离线信箱合计字节数上限"),
+    "log_level": ("INFO", "日志级别（DEBUG/INFO/WARNING/ERROR）"),
+    "log_file": (None, "滚动日志文件路径，未设置时只输出到控制台"),
+    "log_max_bytes": (10 * 1024 * 1024, "单个日志文件大小上限（字节）"),
+    "log_backup_count": (5, "保留的旧日志文件数量"),
+    "log_format": ("text", "日志文件格式：text 或 json"),
+    "log_debug_sample": (1, "DEBUG 日志每 N 条保留一条"),
+    "log_debug_rate": (20, "DEBUG 日志每秒最多条数"),
+}
+
+# 由日志管道、离线信箱和局域网发现使用、不直接传给 EnhancedServerNetwork 的配置项
+LOG_OPTIONS = [name for name in OPTIONS if name.startswith("log_")]
+MAILBOX_OPTIONS = [name for name in OPTIONS if name.startswith("mailbox_")]
+DISCOVERY_OPTIONS = [name for name in OPTIONS if name.startswith("discovery_")]
+
+
+def default_config():
+    return {name: default for name, (default, _) in OPTIONS.items()}
+
+
+def load_config_file(path):
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    unknown = set(data) - set(OPTIONS)
+    if unknown:
+        raise ValueError(f"未知的配置项: {', '.join(sorted(unknown))}")
+    return data
+
+
+def build_parser(description="即时通讯服务器"):
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("--config", help="JSON 配置文件路径")
+    for name, (default, help_text) in OPTIONS.items():
+        flag = "--" + name.replace("_", "-")
+        if isinstance(default, bool):
+            parser.add_argument(flag, action="store_true", default=None, help=help_text)
+        else:
+            value_type = type(default) if default is not None else str
+            parser.add_argument(flag, type=value_type, help=help_text)
+    return parser
+
+
+# 合并默认值、配置文件和命令行中显式给出的参数
+def resolve_config(args):
+    config = default_config()
+    if args.config:
+        config.update(load_config_file(args.config))
+    for name in OPTIONS:
+        value = getattr(args, name)
+        if value is not None:
+            config[name] = value
+    return config
@@ -0,0 +1,115 @@
+"""局域网服务器发现
+
+服务器在 UDP 端口上加入组播组，同时也能收到发往该端口的广播；
+收到客户端的探测包后单播回复自己的聊天端口、当前负载和支持的功能，
+客户端据此选择负载最低的服务器。探测与回复都是一个 JSON 数据报：
+
+    探测  {"type": "discover", "version": 1}
+    回复  {"type": "server", "epoch": "...", "port": 8080, "web_port": 8081,
+           "load": 12, "capabilities": ["resume", "rooms", ...]}
+
+回复中不带地址时，客户端使用回复数据报的源地址；
+多网卡主机可能从不同地址回复同一轮探测，客户端按 epoch 和端口去重。
+"""
+
+import json
+import logging
+import socket
+import struct
+import threading
+
+# 与客户端 server_discovery.py 保持一致
+DISCOVERY_GROUP = "239.255.80.80"
+DISCOVERY_PORT = 8082
+PROTOCOL_VERSION = 1
+# 探测包和回复都很小，超过该长度的数据报直接忽略
+MAX_DATAGRAM = 1024
+
+logger = logging.getLogger("im.discovery")
+
+
+class DiscoveryResponder:
+    """应答局域网内的服务器发现探测"""
+
+    def __init__(
+        self,
+        network,
+        web_port=None,
+        port=DISCOVERY_PORT,
+        group=DISCOVERY_GROUP,
+        interface="0.0.0.0",
+    ):
+        self.network = network
+        self.web_port = web_port
+        self.port = port
+        self.group = group
+        self.interface = interface
+        self.probes = 0
+        self.sock = None
+
+    # 绑定端口并加入组播组；多进程模式下各工作进程共用同一端口
+    def start(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if hasattr(socket, "SO_REUSEPORT"):
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        sock.bind(("", self.port))
+        if self.group:
+            membership = struct.pack(
+                "4s4s", socket.inet_aton(self.group), socket.inet_aton(self.interface)
+            )
+            try:
+                sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, membership)
+            except OSError as e:
+                # 没有可用的组播路由时仍然可以应答广播探测
+                logger.warning("加入组播组 %s 失败，只应答广播: %s", self.group, e)
+        self.sock = sock
+        threading.Thread(target=self.serve, daemon=True).start()
+        logger.info("局域网发现已启动在 UDP %s 端口", self.port)
+        return self
+
+    def serve(self):
+        while True:
+            try:
+                data, addr = self.sock.recvfrom(MAX_DATAGRAM)
+            except OSError:
+                break
+            try:
+                probe = json.loads(data.decode("utf-8"))
+            except ValueError:
+                continue
+            if not isinstance(probe, dict) or probe.get("type") != "discover":
+                continue
+            self.probes += 1
+            try:
+                self.sock.sendto(self.announcement(), addr)
+            except OSError as e:
+                logger.debug("回复发现探测 %s 失败: %s", addr, e)
+
+    def announcement(self):
+        network = self.network
+        capabilities = ["resume", "rooms", "files"]
+        if self.web_port:
+            capabilities.append("web")
+        if network.mailbox is not None:
+            capabilities.append("mailbox")
+        if network.federation is not None:
+            capabilities.append("federation")
+        info = {
+            "type": "server",
+            "version": PROTOCOL_VERSION,
+            "epoch": network.epoch,
+            "port": network.port,
+            "web_port": self.web_port,
+            "load": len(network.clients),
+            "capabilities": capabilities,
+        }
+        # 只在绑定了具体地址时告知地址，否则由客户端使用数据报的源地址
+        if network.host not in ("", "0.0.0.0"):
+            info["host"] = network.host
+        return json.dumps(info).encode("utf-8")
+
+    def stop(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
@@ -0,0 +1,373 @@
+"""服务器联邦：多个服务器节点互联组成同一个聊天空间
+
+节点之间通过 TCP 链路交换批量帧（每行一个 JSON）：
+- 聊天消息带全局唯一的 msg_id（节点 + 启动纪元 + 计数），已见过的直接丢弃，
+  既去重又防止环路；ttl 限制最大转发跳数；
+- 在线用户按来源节点 + 启动纪元 + 版本号同步，定期刷新，超时未刷新的节点视为下线；
+  节点重启后纪元变大，对端丢弃旧纪元的记录；
+- 每条消息带发送时间，接收方统计单跳延迟（im_federation_hop_seconds）。
+
+本机多进程测试（其余参数与 server.py 相同；同一目录下的节点要分开文件目录和信箱）：
+    python server/federation.py --node-id a --port 8080 --web-port 8081 \\
+        --fed-port 9090 --peer 127.0.0.1:9091 --files-dir files_a --mailbox-path mb_a.gz
+    python server/federation.py --node-id b --port 8082 --web-port 8083 \\
+        --fed-port 9091 --peer 127.0.0.1:9090 --files-dir files_b --mailbox-path mb_b.gz
+"""
+
+import itertools
+import json
+import logging
+import queue
+import random
+import socket
+import threading
+import time
+from collections import OrderedDict
+
+# 记住的 msg_id 数量，用于去重
+SEEN_SIZE = 100000
+# 消息最多转发的跳数
+DEFAULT_TTL = 8
+# 在线用户刷新间隔和过期时间（秒）
+PRESENCE_INTERVAL = 10
+PRESENCE_TIMEOUT = 30
+HOP_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+
+logger = logging.getLogger("im.federation")
+
+
+class FederationLink:
+    """与一个对端节点的链路，发送方向按批次合并"""
+
+    def __init__(self, federation, sock, peer_id):
+        self.federation = federation
+        self.sock = sock
+        self.peer_id = peer_id
+        self.outbound = queue.Queue(maxsize=10000)
+        self.closed = threading.Event()
+        threading.Thread(target=self.write_batches, daemon=True).start()
+
+    def send(self, item):
+        try:
+            self.outbound.put_nowait(item)
+        except queue.Full:
+            self.federation.dropped.inc(1, self.peer_id)
+
+    # 等待 batch_interval 或凑满 batch_size 后一次发出
+    def write_batches(self):
+        federation = self.federation
+        try:
+            while not self.closed.is_set():
+                try:
+                    items = [self.outbound.get(timeout=1.0)]
+                except queue.Empty:
+                    continue
+                deadline = time.monotonic() + federation.batch_interval
+                while len(items) < federation.batch_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    try:
+                        items.append(self.outbound.get(timeout=remaining))
+                    except queue.Empty:
+                        break
+                data = json.dumps(
+                    {"type": "fed_batch", "items": items}, ensure_ascii=False
+                )
+                self.sock.sendall(data.encode("utf-8") + b"\n")
+                federation.batches.inc(1, self.peer_id)
+        except OSError:
+            self.close()
+
+    def close(self):
+        if self.closed.is_set():
+            return
+        self.closed.set()
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+        self.federation.remove_link(self)
+
+
+class Federation:
+    def __init__(
+        self,
+        node_id,
+        listen=None,
+        peers=(),
+        batch_interval=0.02,
+        batch_size=64,
+        ttl=DEFAULT_TTL,
+    ):
+        self.node_id = node_id
+        self.listen = listen
+        self.peers = list(peers)
+        self.batch_interval = batch_interval
+        self.batch_size = batch_size
+        self.ttl = ttl
+        self.network = None
+        self.links = []
+        self.lock = threading.Lock()
+        # 启动纪元：计数和版本号每次启动都从头开始，对端据此识别本节点已重启
+        self.epoch = int(time.time() * 1000)
+        self.counter = itertools.count(1)
+        self.seen = OrderedDict()
+        # 各节点的在线用户：
+        # {node_id: {"epoch": int, "version": int, "users": [...], "nicknames": set,
+        #            "updated": float}}
+        self.presence = {}
+        self.presence_version = 0
+        self.local_users = []
+
+    def attach(self, network):
+        self.network = network
+        metrics = network.metrics
+        self.hop_seconds = metrics.histogram(
+            "im_federation_hop_seconds", "联邦消息单跳延迟", HOP_BUCKETS
+        )
+        self.forwarded = metrics.counter(
+            "im_federation_items_total", "联邦链路收到的条目", labels=("result",)
+        )
+        self.batches = metrics.counter(
+            "im_federation_batches_total", "发往各节点的批次数", labels=("peer",)
+        )
+        self.dropped = metrics.counter(
+            "im_federation_dropped_total", "链路队列满而丢弃的条目", labels=("peer",)
+        )
+        metrics.callback_gauge(
+            "im_federation_links", "当前联邦链路数", lambda: len(self.links)
+        )
+
+        if self.listen:
+            server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            server_socket.bind(self.listen)
+            server_socket.listen(16)
+            threading.Thread(
+                target=self.accept_links, args=(server_socket,), daemon=True
+            ).start()
+        for peer in self.peers:
+            threading.Thread(target=self.dial, args=(peer,), daemon=True).start()
+        threading.Thread(target=self.refresh_presence, daemon=True).start()
+
+    def accept_links(self, server_socket):
+        while True:
+            sock, _ = server_socket.accept()
+            threading.Thread(
+                target=self.run_link, args=(sock, False), daemon=True
+            ).start()
+
+    # 主动连接对端，断开后带抖动退避重连
+    def dial(self, peer):
+        delay = 0.5
+        while True:
+            try:
+                sock = socket.create_connection(peer, timeout=5)
+                sock.settimeout(None)
+                if self.run_link(sock, True):
+                    delay = 0.5
+            except OSError:
+                pass
+            time.sleep(random.uniform(0, delay))
+            delay = min(delay * 2, 30)
+
+    # 返回 False 表示握手失败或链路重复被拒绝
+    def run_link(self, sock, dialed):
+        hello = {"type": "fed_hello", "node_id": self.node_id}
+        sock.sendall(json.dumps(hello).encode("utf-8") + b"\n")
+        reader = sock.makefile("rb")
+        hello = json.loads(reader.readline() or b"{}")
+        peer_id = hello.get("node_id")
+        if not peer_id or peer_id == self.node_id:
+            sock.close()
+            return False
+        # 两个节点互相配置为对端时会建立两条链路，双方统一保留由较小 node_id 发起的那条
+        dialer = self.node_id if dialed else peer_id
+        link = FederationLink(self, sock, peer_id)
+        with self.lock:
+            existing = [other for other in self.links if other.peer_id == peer_id]
+            rejected = existing and dialer != min(self.node_id, peer_id)
+            if not rejected:
+                self.links.append(link)
+        if rejected:
+            link.closed.set()
+            sock.close()
+            return False
+        for other in existing:
+            other.close()
+        logger.info("联邦链路已建立: %s <-> %s", self.node_id, peer_id)
+        # 新链路建立后同步一次已知的在线用户
+        for item in self._presence_items():
+            link.send(item)
+        try:
+            for line in reader:
+                batch = json.loads(line)
+                for item in batch.get("items", []):
+                    self.handle_item(item, link)
+        except (OSError, ValueError):
+            pass
+        finally:
+            link.close()
+        return True
+
+    def remove_link(self, link):
+        with self.lock:
+            if link in self.links:
+                self.links.remove(link)
+        logger.info("联邦链路已断开: %s <-> %s", self.node_id, link.peer_id)
+
+    def _send_to_links(self, item, exclude=None):
+        with self.lock:
+            links = list(self.links)
+        for link in links:
+            if link is not exclude:
+                link.send(item)
+
+    # 返回 False 表示该 msg_id 已经处理过
+    def _mark_seen(self, msg_id):
+        with self.lock:
+            if msg_id in self.seen:
+                return False
+            self.seen[msg_id] = True
+            while len(self.seen) > SEEN_SIZE:
+                self.seen.popitem(last=False)
+            return True
+
+    # 本节点客户端发出的消息，发给所有对端
+    def publish(self, message):
+        msg_id = f"{self.node_id}:{self.epoch:x}:{next(self.counter)}"
+        self._mark_seen(msg_id)
+        item = {
+            "kind": "message",
+            "msg_id": msg_id,
+            "origin": self.node_id,
+            "ttl": self.ttl,
+            "sent_at": time.time(),
+            "message": {k: v for k, v in message.items() if k != "seq"},
+        }
+        self._send_to_links(item)
+
+    def handle_item(self, item, link):
+        if item["kind"] == "message":
+            if not self._mark_seen(item["msg_id"]):
+                self.forwarded.inc(1, "duplicate")
+                return
+            self.hop_seconds.observe(max(0.0, time.time() - item["sent_at"]))
+            self.forwarded.inc(1, "delivered")
+            # 在本节点分配序号并投递，不再经过 route_message 以免重复发布
+            self.network.deliver_message(dict(item["message"]))
+            if item["ttl"] > 1:
+                forward = dict(item, ttl=item["ttl"] - 1, sent_at=time.time())
+                self._send_to_links(forward, exclude=link)
+        elif item["kind"] == "presence":
+            origin = item["origin"]
+            if origin == self.node_id:
+                return
+            epoch = item.get("epoch", 0)
+            current = (epoch, item["version"])
+            with self.lock:
+                known = self.presence.get(origin)
+                if known and (known["epoch"], known["version"]) >= current:
+                    # 版本未变，只刷新时间；不再转发，避免环路
+                    # 对端重启前的旧纪元条目不算刷新，否则旧记录永远不会过期
+                    if known["epoch"] == epoch:
+                        known["updated"] = time.monotonic()
+                    return
+                # 纪元变化说明对端已重启，直接替换旧记录
+                self.presence[origin] = {
+                    "epoch": epoch,
+                    "version": item["version"],
+                    "users": item["users"],
+                    "nicknames": {user["nickname"] for user in item["users"]},
+                    "updated": time.monotonic(),
+                }
+            self._send_to_links(item, exclude=link)
+            self.network.broadcast(self.network._user_list_message())
+
+    # 本节点在线用户变化
+    def publish_presence(self, users):
+        with self.lock:
+            self.presence_version += 1
+            self.local_users = users
+        self._send_to_links(self._local_presence_item())
+
+    def _local_presence_item(self):
+        return {
+            "kind": "presence",
+            "origin": self.node_id,
+            "epoch": self.epoch,
+            "version": self.presence_version,
+            "users": self.local_users,
+        }
+
+    def _presence_items(self):
+        with self.lock:
+            items = [
+                {
+                    "kind": "presence",
+                    "origin": origin,
+                    "epoch": entry["epoch"],
+                    "version": entry["version"],
+                    "users": entry["users"],
+                }
+                for origin, entry in self.presence.items()
+            ]
+        return items + [self._local_presence_item()]
+
+    # 定期重发本节点在线用户（版本号递增），并清理长时间未刷新的节点
+    def refresh_presence(self):
+        while True:
+            time.sleep(PRESENCE_INTERVAL)
+            with self.lock:
+                self.presence_version += 1
+            self._send_to_links(self._local_presence_item())
+            now = time.monotonic()
+            with self.lock:
+                expired = [
+                    origin
+                    for origin, entry in self.presence.items()
+                    if now - entry["updated"] > PRESENCE_TIMEOUT
+                ]
+                for origin in expired:
+                    del self.presence[origin]
+            if expired:
+                self.network.broadcast(self.network._user_list_message())
+
+    def remote_users(self):
+        with self.lock:
+            return [user for entry in self.presence.values() for user in entry["users"]]
+
+    def is_online(self, nickname):
+        with self.lock:
+            return any(
+                nickname in entry["nicknames"] for entry in self.presence.values()
+            )
+
+
+def parse_address(value):
+    host, port = value.rsplit(":", 1)
+    return host, int(port)
+
+
+if __name__ == "__main__":
+    # 其余配置项（配置文件、admin_token、文件目录、信箱、超时等）与 server.py 相同
+    from config import build_parser, resolve_config
+    from server import serve, start_server
+
+    parser = build_parser("联邦模式服务器节点")
+    parser.add_argument("--node-id", required=True)
+    parser.add_argument("--fed-port", type=int, default=9090, help="联邦链路监听端口")
+    parser.add_argument(
+        "--peer", action="append", default=[], type=parse_address, help="对端 host:port"
+    )
+    args = parser.parse_args()
+    config = resolve_config(args)
+    if config["handoff_path"]:
+        parser.error("联邦节点不支持热重启（--handoff-path）")
+
+    federation = Federation(
+        args.node_id, listen=(config["host"], args.fed_port), peers=args.peer
+    )
+    network, _ = start_server(config, federation=federation)
+    serve(network)
@@ -0,0 +1,199 @@
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+# 默认配额 1GB
+DEFAULT_QUOTA = 1024 * 1024 * 1024
+# 后台清理把占用压到配额的这个比例以下，给新上传留出余量
+LOW_WATER = 0.8
+# 磁盘剩余空间低于该值时拒绝上传，即使配额还没用完
+MIN_DISK_FREE = 64 * 1024 * 1024
+PART_SUFFIX = ".part"
+
+logger = logging.getLogger("im.files")
+
+
+# 只接受普通文件名："."、".." 会指向目录本身或上级，.part 与上传中的临时文件混淆
+def valid_file_name(name):
+    return (
+        name not in ("", ".", "..")
+        and name == os.path.basename(name)
+        and not name.endswith(PART_SUFFIX)
+    )
+
+
+class Reservation:
+    """一次上传预留的空间；写入临时文件，commit 后才出现在目录中"""
+
+    def __init__(self, store, name, size):
+        self.store = store
+        self.name = name
+        self.size = size
+        self.temp_path = os.path.join(
+            store.root, f"{name}.{uuid.uuid4().hex[:8]}{PART_SUFFIX}"
+        )
+        self.done = False
+
+    def commit(self):
+        self.store._commit(self)
+
+    def abort(self):
+        self.store._abort(self)
+
+
+class FileStore:
+    """带配额的接收文件目录
+
+    上传前先预留空间，配额或磁盘空间不足时先按 LRU 删除旧文件腾出空间，
+    仍然不够才拒绝，不会写到一半才失败；
+    文件按最近访问时间排序，后台线程删除过期文件，并按 LRU 把占用压到低水位以下。
+    """
+
+    def __init__(
+        self, root="received_files", quota=DEFAULT_QUOTA, max_age=None, interval=30.0
+    ):
+        self.root = root
+        self.quota = quota
+        self.max_age = max_age
+        self.interval = interval
+        self.lock = threading.Lock()
+        # {文件名: [大小, 最近访问时间]}，越靠前越久未访问
+        self.files = OrderedDict()
+        self.used = 0
+        self.reserved = 0
+        self.evicted_files = 0
+        self.evicted_bytes = 0
+        self.rejected = 0
+        self.wakeup = threading.Event()
+        os.makedirs(root, exist_ok=True)
+        self._scan()
+        threading.Thread(target=self._maintain, daemon=True).start()
+
+    # 启动时重建索引，清理上次中断留下的临时文件
+    def _scan(self):
+        entries = []
+        for entry in os.scandir(self.root):
+            if not entry.is_file():
+                continue
+            if entry.name.endswith(PART_SUFFIX):
+                os.unlink(entry.path)
+                continue
+            stat = entry.stat()
+            entries.append(
+                (max(stat.st_atime, stat.st_mtime), entry.name, stat.st_size)
+            )
+        for accessed, name, size in sorted(entries):
+            self.files[name] = [size, accessed]
+            self.used += size
+
+    # 预留空间；空间不足时同步删除最久未访问的文件，删光也放不下才返回 None
+    def reserve(self, name, size):
+        with self.lock:
+            # 进行中的上传还没写完，它们预留的空间也要从磁盘剩余空间中扣除
+            free = shutil.disk_usage(self.root).free - self.reserved
+            shortfall = MIN_DISK_FREE + size - free
+            # 已有文件最多还能占用的字节数
+            limit = min(
+                self.quota - self.reserved - size, self.used - max(0, shortfall)
+            )
+            if limit < 0:
+                self.rejected += 1
+                return None
+            victims = self._take_victims(limit)
+            self.reserved += size
+        self._unlink(victims)
+        return Reservation(self, name, size)
+
+    def _commit(self, reservation):
+        path = os.path.join(self.root, reservation.name)
+        size = os.path.getsize(reservation.temp_path)
+        os.replace(reservation.temp_path, path)
+        with self.lock:
+            self.reserved -= reservation.size
+            old = self.files.pop(reservation.name, None)
+            if old is not None:
+                self.used -= old[0]
+            self.files[reservation.name] = [size, time.time()]
+            self.used += size
+            reservation.done = True
+            over = self.used > self.quota * LOW_WATER
+        if over:
+            self.wakeup.set()
+
+    def _abort(self, reservation):
+        with self.lock:
+            if reservation.done:
+                return
+            self.reserved -= reservation.size
+            reservation.done = True
+        try:
+            os.unlink(reservation.temp_path)
+        except FileNotFoundError:
+            pass
+
+    # 返回文件路径并更新访问时间；不存在时返回 None
+    def open_path(self, name):
+        with self.lock:
+            info = self.files.get(name)
+            if info is None:
+                return None
+            info[1] = time.time()
+            self.files.move_to_end(name)
+        return os.path.join(self.root, name)
+
+    def _maintain(self):
+        while True:
+            self.wakeup.wait(self.interval)
+            self.wakeup.clear()
+            try:
+                self.evict()
+            except OSError as e:
+                logger.warning("清理接收文件失败: %s", e)
+
+    # 删除过期文件，再按最久未访问的顺序删到低水位以下
+    def evict(self):
+        with self.lock:
+            victims = self._take_victims(self.quota * LOW_WATER, expire=True)
+        self._unlink(victims)
+        return victims
+
+    # 调用方持有 lock：从最久未访问的文件开始移出索引，直到占用不超过 limit
+    def _take_victims(self, limit, expire=False):
+        now = time.time()
+        victims = []
+        while self.files:
+            name, (size, accessed) = next(iter(self.files.items()))
+            expired = expire and self.max_age and now - accessed > self.max_age
+            if not expired and self.used <= limit:
+                break
+            del self.files[name]
+            self.used -= size
+            self.evicted_files += 1
+            self.evicted_bytes += size
+            victims.append(name)
+        return victims
+
+    def _unlink(self, victims):
+        for name in victims:
+            try:
+                os.unlink(os.path.join(self.root, name))
+            except FileNotFoundError:
+                pass
+        if victims:
+            logger.info("已清理 %d 个接收文件", len(victims))
+
+    def stats(self):
+        with self.lock:
+            return {
+                "quota": self.quota,
+                "used": self.used,
+                "reserved": self.reserved,
+                "files": len(self.files),
+                "evicted_files": self.evicted_files,
+                "evicted_bytes": self.evicted_bytes,
+                "rejected": self.rejected,
+            }
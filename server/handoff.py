@@ -0,0 +1,220 @@
+"""热重启：通过 Unix socket 把监听socket（可选连同已建立的连接）交给新进程
+
+旧进程在 handoff_path 上等待接管请求；新进程以 --takeover 启动：
+
+    python server/server.py --handoff-path /run/im/handoff.sock --takeover
+
+1. 新进程连接 handoff_path，发送 {"type": "takeover"}；
+2. 旧进程停止 accept（监听socket不关闭，期间的新连接在监听队列中排队），
+   启用 handoff_connections 时让每个连接的读线程在帧边界处暂停并写完发送队列，
+   然后把离线信箱写盘，发送状态（纪元、序号、历史、会话）和文件描述符；
+3. 新进程用收到的监听socket和状态创建服务器，接管连接后回复 {"type": "ready"}；
+4. 旧进程关闭自己持有的描述符副本（不 shutdown，连接仍由新进程使用），
+   排空没能交接的连接后退出。新进程在 ready 之前失败时，旧进程恢复服务。
+
+纪元和序号随状态一起交接，不交接连接时客户端重连新进程后也能继续补发。
+依赖 socket.send_fds/recv_fds（Python 3.9+，仅限 Unix）。
+"""
+
+import json
+import logging
+import os
+import socket
+import struct
+import threading
+
+# 一条 SCM_RIGHTS 消息最多携带的描述符数（Linux 上限为 253）
+MAX_FDS_PER_MESSAGE = 200
+# 等待对方响应的最长时间（秒）
+HANDOFF_TIMEOUT = 30.0
+# 状态长度前缀
+LENGTH = struct.Struct("!Q")
+
+logger = logging.getLogger("im.handoff")
+
+
+def _send_line(sock, message):
+    sock.sendall(json.dumps(message).encode("utf-8") + b"\n")
+
+
+def _recv_line(sock):
+    data = b""
+    while not data.endswith(b"\n"):
+        chunk = sock.recv(1)
+        if not chunk:
+            raise ConnectionError("交接通道已关闭")
+        data += chunk
+    return json.loads(data.decode("utf-8"))
+
+
+def _recv_exact(sock, size):
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(min(65536, size - len(data)))
+        if not chunk:
+            raise ConnectionError("交接通道已关闭")
+        data += chunk
+    return bytes(data)
+
+
+class HandoffListener:
+    """旧进程一侧：等待新进程接管，交出监听socket、状态和连接"""
+
+    def __init__(self, network, path, timeout=HANDOFF_TIMEOUT):
+        self.network = network
+        self.path = path
+        self.timeout = timeout
+        # 交接完成（handed_over 为 True）或进程收到停止信号时置位，主线程据此退出
+        self.done = threading.Event()
+        self.handed_over = False
+        self.sock = None
+
+    def start(self):
+        # 上一个进程留下的 socket 文件已无人监听，直接替换
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(self.path)
+        os.chmod(self.path, 0o600)
+        sock.listen(1)
+        self.sock = sock
+        threading.Thread(target=self.serve, daemon=True).start()
+        logger.info("等待热重启接管: %s", self.path)
+        return self
+
+    def serve(self):
+        while not self.done.is_set():
+            try:
+                channel, _ = self.sock.accept()
+            except OSError:
+                break
+            with channel:
+                channel.settimeout(self.timeout)
+                try:
+                    if _recv_line(channel).get("type") != "takeover":
+                        continue
+                except (OSError, ValueError) as e:
+                    logger.warning("无效的接管请求: %s", e)
+                    continue
+                self.hand_over(channel)
+
+    def hand_over(self, channel):
+        network = self.network
+        logger.info("开始热重启交接")
+        network.stop_accepting()
+        detached = []
+        if network.handoff_connections:
+            detached = network.detach_connections(network.drain_timeout)
+        else:
+            network.draining = True
+        mailbox_path = None
+        if network.mailbox is not None:
+            mailbox_path = network.mailbox.path
+            network.mailbox.close()
+
+        try:
+            self._send_state(channel, detached)
+        except Exception as e:
+            # 新进程在就绪之前失败：本进程恢复服务
+            logger.error("热重启交接失败，恢复服务: %s", e)
+            if network.mailbox is not None:
+                network.mailbox.path = mailbox_path
+            network.reattach_connections(detached)
+            return
+
+        # 连接已由新进程使用，只关闭本进程的副本，不能 shutdown
+        for _, client, _ in detached:
+            client["socket"].close()
+        # 没能暂停的连接（例如正在传文件）按排空处理，由客户端重连新进程
+        network.drain()
+        self.handed_over = True
+        self.done.set()
+        logger.info("热重启交接完成，已交出 %d 个连接", len(detached))
+
+    # 发送状态和描述符，等待新进程回复就绪
+    def _send_state(self, channel, detached):
+        network = self.network
+        fds = [network.server_socket.fileno(), network.web_server.socket.fileno()]
+        connections = []
+        for key, client, buffer in detached:
+            fds.append(client["socket"].fileno())
+            connections.append(
+                {
+                    "key": key,
+                    "ip": client["ip"],
+                    "nickname": client["nickname"],
+                    "session_id": client["session_id"],
+                    "rooms": sorted(client["rooms"]),
+                    # 读到一半的帧原样交给新进程
+                    "buffer": buffer.decode("latin-1"),
+                }
+            )
+        state = {
+            "network": network.export_state(),
+            "connections": connections,
+            "fds": len(fds),
+        }
+        payload = json.dumps(state, ensure_ascii=False).encode("utf-8")
+        channel.sendall(LENGTH.pack(len(payload)) + payload)
+        for start in range(0, len(fds), MAX_FDS_PER_MESSAGE):
+            socket.send_fds(channel, [b"F"], fds[start : start + MAX_FDS_PER_MESSAGE])
+        if _recv_line(channel).get("type") != "ready":
+            raise ConnectionError("新进程未就绪")
+
+
+class Takeover:
+    """新进程一侧：从旧进程收到的监听socket、状态和连接"""
+
+    def __init__(self, channel, listen_socket, web_socket, state, connections):
+        self.channel = channel
+        self.listen_socket = listen_socket
+        self.web_socket = web_socket
+        self.state = state
+        # [(socket, 连接信息)]
+        self.connections = connections
+
+    # 接管交过来的连接，它们的读线程从旧进程停下的位置继续
+    def adopt(self, network):
+        for sock, info in self.connections:
+            network.add_connection(
+                sock,
+                info["key"],
+                info["ip"],
+                info["buffer"].encode("latin-1"),
+                info["nickname"],
+                info["session_id"],
+                info["rooms"],
+            )
+
+    # 通知旧进程可以退出
+    def ready(self):
+        _send_line(self.channel, {"type": "ready"})
+        self.channel.close()
+
+
+def request_takeover(path, timeout=HANDOFF_TIMEOUT):
+    channel = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    channel.settimeout(timeout)
+    channel.connect(path)
+    _send_line(channel, {"type": "takeover"})
+
+    (size,) = LENGTH.unpack(_recv_exact(channel, LENGTH.size))
+    state = json.loads(_recv_exact(channel, size).decode("utf-8"))
+    fds = []
+    while len(fds) < state["fds"]:
+        _, received, _, _ = socket.recv_fds(channel, 1, MAX_FDS_PER_MESSAGE)
+        if not received:
+            raise ConnectionError("交接通道已关闭")
+        fds += received
+
+    listen_socket = socket.socket(fileno=fds[0])
+    web_socket = socket.socket(fileno=fds[1])
+    connections = []
+    for fd, info in zip(fds[2:], state["connections"]):
+        sock = socket.socket(fileno=fd)
+        sock.setblocking(True)
+        connections.append((sock, info))
+    logger.info("已从旧进程接管监听socket和 %d 个连接", len(connections))
+    return Takeover(channel, listen_socket, web_socket, state["network"], connections)
@@ -0,0 +1,189 @@
+"""服务器日志管道
+
+业务线程只把日志记录放进有界队列（满了直接丢弃），格式化和写入都在后台线程完成：
+- 控制台输出、可选的滚动日志文件（文本或每行一个 JSON）；
+- 内存环形缓冲区，供 /admin/logs 和图形控制台按批次拉取；
+- DEBUG 级别的逐条消息日志先采样再限速，避免高消息速率下日志比转发还贵。
+"""
+
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+from collections import deque
+
+LOGGER_NAME = "im"
+# 日志队列长度，写入跟不上时丢弃新日志而不阻塞业务线程
+QUEUE_SIZE = 10000
+# 环形缓冲区保留的最近日志行数
+RING_SIZE = 2000
+TEXT_FORMAT = "%(asctime)s %(levelname)s %(name)s %(message)s"
+
+_listener = None
+_listener_pid = None
+ring_buffer = None
+queue_handler = None
+
+
+class DebugSampler(logging.Filter):
+    """DEBUG 日志每 sample_every 条保留一条，且每秒最多 max_per_second 条；其他级别原样通过"""
+
+    def __init__(self, sample_every=1, max_per_second=20):
+        super().__init__()
+        self.sample_every = max(1, sample_every)
+        self.max_per_second = max_per_second
+        self.lock = threading.Lock()
+        self.seen = 0
+        self.window_start = 0.0
+        self.window_count = 0
+        self.suppressed = 0
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG:
+            return True
+        with self.lock:
+            self.seen += 1
+            if self.seen % self.sample_every:
+                self.suppressed += 1
+                return False
+            now = time.monotonic()
+            if now - self.window_start >= 1.0:
+                self.window_start = now
+                self.window_count = 0
+            if self.window_count >= self.max_per_second:
+                self.suppressed += 1
+                return False
+            self.window_count += 1
+            suppressed, self.suppressed = self.suppressed, 0
+        if suppressed:
+            record.msg = f"{record.msg}（此前省略 {suppressed} 条调试日志）"
+        return True
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """队列满时丢弃日志并计数，从不阻塞调用方"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    # 不在业务线程里格式化，留给后台线程
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class RingBufferHandler(logging.Handler):
+    """保存最近的日志行，每行带递增编号，便于按编号增量拉取"""
+
+    def __init__(self, capacity=RING_SIZE):
+        super().__init__()
+        self.lines = deque(maxlen=capacity)
+        self.next_index = 0
+
+    def emit(self, record):
+        line = self.format(record)
+        with self.lock:
+            self.lines.append((self.next_index, line))
+            self.next_index += 1
+
+    # 返回编号不小于 since 的日志行；since 早于缓冲区起点时 truncated 为 True
+    def lines_since(self, since=0):
+        with self.lock:
+            lines = list(self.lines)
+            next_index = self.next_index
+        first = lines[0][0] if lines else next_index
+        return {
+            "next": next_index,
+            "truncated": since < first,
+            "lines": [line for index, line in lines if index >= since],
+        }
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+def setup_logging(
+    level="INFO",
+    log_file=None,
+    max_bytes=10 * 1024 * 1024,
+    backup_count=5,
+    log_format="text",
+    debug_sample=1,
+    debug_rate=20,
+):
+    """配置 im.* 日志；可重复调用（例如多进程模式的子进程中），会替换之前的配置"""
+    global _listener, _listener_pid, ring_buffer, queue_handler
+
+    if _listener is not None and _listener_pid == os.getpid():
+        _listener.stop()
+
+    text_formatter = logging.Formatter(TEXT_FORMAT)
+    console = logging.StreamHandler(sys.stderr)
+    console.setFormatter(text_formatter)
+    ring_buffer = RingBufferHandler()
+    ring_buffer.setFormatter(text_formatter)
+    handlers = [console, ring_buffer]
+    if log_file:
+        directory = os.path.dirname(log_file)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        file_handler = logging.handlers.RotatingFileHandler(
+            log_file, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8"
+        )
+        file_handler.setFormatter(
+            JsonFormatter() if log_format == "json" else text_formatter
+        )
+        handlers.append(file_handler)
+
+    log_queue = queue.Queue(maxsize=QUEUE_SIZE)
+    queue_handler = DroppingQueueHandler(log_queue)
+    queue_handler.addFilter(DebugSampler(debug_sample, debug_rate))
+
+    logger = logging.getLogger(LOGGER_NAME)
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    logger.addHandler(queue_handler)
+    logger.setLevel(level.upper() if isinstance(level, str) else level)
+    logger.propagate = False
+
+    _listener = logging.handlers.QueueListener(log_queue, *handlers)
+    _listener.start()
+    _listener_pid = os.getpid()
+    return queue_handler
+
+
+# 供管理接口增量拉取：编号不小于 since 的日志行，以及因队列满丢弃的日志数
+def recent_logs(since=0):
+    if ring_buffer is None:
+        return {"next": 0, "truncated": False, "lines": [], "dropped": 0}
+    result = ring_buffer.lines_since(since)
+    result["dropped"] = queue_handler.dropped
+    return result
+
+
+# 进程退出前把队列中剩余的日志写完
+def shutdown_logging():
+    global _listener
+    if _listener is not None and _listener_pid == os.getpid():
+        _listener.stop()
+    _listener = None
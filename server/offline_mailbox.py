@@ -0,0 +1,177 @@
+import gzip
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+
+# 持久化文件格式：gzip 压缩的 JSON 行，首行为版本头，之后每行 [昵称, 过期时间, 消息JSON]
+MAILBOX_VERSION = 1
+# 离线消息默认保留 7 天
+MAILBOX_TTL = 7 * 24 * 3600
+# 每个用户最多保留的离线消息数
+MAX_MESSAGES_PER_USER = 100
+# 所有信箱合计占用的字节数上限
+MAX_TOTAL_BYTES = 16 * 1024 * 1024
+
+logger = logging.getLogger("im.mailbox")
+
+
+class MailboxStore:
+    """离线私聊消息的存储转发信箱
+
+    按昵称一个信箱，字典查找 O(1)。消息以编码后的字节保存，
+    内存占用按字节精确统计：单个信箱超过条数上限时丢弃最早的消息，
+    总字节数超限时从最久没有收到新消息的信箱开始淘汰。
+    有 path 时由后台线程定期清理过期消息，并在有变化时整体重写快照文件。
+    """
+
+    def __init__(
+        self,
+        path=None,
+        ttl=MAILBOX_TTL,
+        max_messages=MAX_MESSAGES_PER_USER,
+        max_bytes=MAX_TOTAL_BYTES,
+        flush_interval=5.0,
+    ):
+        self.path = path
+        self.ttl = ttl
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self.flush_interval = flush_interval
+        # {昵称: deque[(过期时间, 消息字节)]}，按最近写入排序
+        self.boxes = OrderedDict()
+        self.total_bytes = 0
+        self.message_count = 0
+        self.evicted = 0
+        self.lock = threading.Lock()
+        self.dirty = False
+        self.flush_lock = threading.Lock()
+        if path:
+            self._load()
+        threading.Thread(target=self._maintain, daemon=True).start()
+
+    def put(self, nickname, message):
+        data = json.dumps(message, ensure_ascii=False).encode("utf-8")
+        with self.lock:
+            self._append(nickname, time.time() + self.ttl, data)
+            self.dirty = True
+
+    def _append(self, nickname, expires_at, data):
+        box = self.boxes.get(nickname)
+        if box is None:
+            box = self.boxes[nickname] = deque()
+        else:
+            self.boxes.move_to_end(nickname)
+        box.append((expires_at, data))
+        self.total_bytes += len(data)
+        self.message_count += 1
+        while len(box) > self.max_messages:
+            self._drop(nickname, box)
+        while self.total_bytes > self.max_bytes and self.boxes:
+            oldest, oldest_box = next(iter(self.boxes.items()))
+            self._drop(oldest, oldest_box)
+
+    def _drop(self, nickname, box):
+        _, data = box.popleft()
+        self.total_bytes -= len(data)
+        self.message_count -= 1
+        self.evicted += 1
+        if not box:
+            del self.boxes[nickname]
+
+    # 取出并清空该用户的信箱，只返回未过期的消息
+    def take(self, nickname):
+        with self.lock:
+            box = self.boxes.pop(nickname, None)
+            if not box:
+                return []
+            self.total_bytes -= sum(len(data) for _, data in box)
+            self.message_count -= len(box)
+            self.dirty = True
+        now = time.time()
+        return [json.loads(data) for expires_at, data in box if expires_at > now]
+
+    def expire(self):
+        now = time.time()
+        removed = 0
+        with self.lock:
+            for nickname, box in list(self.boxes.items()):
+                while box and box[0][0] <= now:
+                    _, data = box.popleft()
+                    self.total_bytes -= len(data)
+                    self.message_count -= 1
+                    removed += 1
+                if not box:
+                    del self.boxes[nickname]
+            if removed:
+                self.dirty = True
+        return removed
+
+    def stats(self):
+        return {
+            "users": len(self.boxes),
+            "messages": self.message_count,
+            "bytes": self.total_bytes,
+            "evicted": self.evicted,
+        }
+
+    def _maintain(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.expire()
+            if self.path:
+                self.flush()
+
+    # 同一时间只有一次写快照，close 返回时文件一定已经写完
+    def flush(self):
+        with self.flush_lock:
+            with self.lock:
+                path = self.path
+                if not self.dirty or not path:
+                    return
+                entries = [
+                    (nickname, expires_at, data)
+                    for nickname, box in self.boxes.items()
+                    for expires_at, data in box
+                ]
+                self.dirty = False
+            # 先写临时文件再替换，避免写到一半崩溃导致文件损坏
+            tmp_path = path + ".tmp"
+            try:
+                with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+                    f.write(json.dumps({"version": MAILBOX_VERSION}) + "\n")
+                    for nickname, expires_at, data in entries:
+                        line = [nickname, round(expires_at, 1), data.decode("utf-8")]
+                        f.write(json.dumps(line, ensure_ascii=False) + "\n")
+                os.replace(tmp_path, path)
+            except OSError as e:
+                logger.warning("保存离线信箱失败: %s", e)
+                with self.lock:
+                    self.dirty = True
+
+    # 热重启前把快照交给新进程：写完最后一次后不再写文件，避免覆盖新进程的改动
+    def close(self):
+        self.flush()
+        with self.lock:
+            self.path = None
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        now = time.time()
+        try:
+            with gzip.open(self.path, "rt", encoding="utf-8") as f:
+                header = json.loads(f.readline())
+                if header.get("version") != MAILBOX_VERSION:
+                    raise ValueError(f"不支持的信箱文件版本: {header.get('version')}")
+                for line in f:
+                    nickname, expires_at, data = json.loads(line)
+                    if expires_at > now:
+                        self._append(nickname, expires_at, data.encode("utf-8"))
+        except (OSError, ValueError) as e:
+            logger.warning("读取离线信箱失败: %s", e)
+        logger.info(
+            "已加载离线信箱：%d 个用户，%d 条消息", len(self.boxes), self.message_count
+        )
@@ -0,0 +1,165 @@
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter as StackCounter
+from contextlib import nullcontext
+from datetime import datetime
+
+# 关闭时所有 span 共用同一个空上下文，开销只有一次属性判断
+NULL_SPAN = nullcontext()
+# 单次分析的最长时间，避免忘记关闭
+MAX_PROFILE_SECONDS = 300
+
+
+class _Span:
+    __slots__ = ("profiler", "stage", "started")
+
+    def __init__(self, profiler, stage):
+        self.profiler = profiler
+        self.stage = stage
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.profiler.record_span(self.stage, time.perf_counter() - self.started)
+        return False
+
+
+class Profiler:
+    """按需开启的采样 CPU 分析、tracemalloc 快照和分阶段耗时统计
+
+    开启后在限定时间内运行，结束时把报告写入 report_dir，可通过管理接口下载。
+    """
+
+    def __init__(self, report_dir="profiles", metrics=None):
+        self.report_dir = report_dir
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.span_stats = {}  # {阶段: [次数, 总耗时, 最大耗时]}
+        self.stage_seconds = None
+        if metrics is not None:
+            self.stage_seconds = metrics.histogram(
+                "im_stage_seconds", "分析开启期间各处理阶段的耗时", labels=("stage",)
+            )
+        self.finished_at = None
+
+    def span(self, stage):
+        if not self.enabled:
+            return NULL_SPAN
+        return _Span(self, stage)
+
+    def record_span(self, stage, seconds):
+        with self.lock:
+            stats = self.span_stats.get(stage)
+            if stats is None:
+                stats = self.span_stats[stage] = [0, 0.0, 0.0]
+            stats[0] += 1
+            stats[1] += seconds
+            stats[2] = max(stats[2], seconds)
+        if self.stage_seconds is not None:
+            self.stage_seconds.observe(seconds, stage)
+
+    # 开始一次分析，已在运行时返回 False
+    def start(self, seconds=30, sample_interval=0.005, trace_memory=True):
+        seconds = max(1, min(float(seconds), MAX_PROFILE_SECONDS))
+        with self.lock:
+            if self.enabled:
+                return False
+            self.enabled = True
+            self.span_stats = {}
+        threading.Thread(
+            target=self._run,
+            args=(seconds, sample_interval, trace_memory),
+            daemon=True,
+        ).start()
+        return True
+
+    def _run(self, seconds, sample_interval, trace_memory):
+        started_tracing = trace_memory and not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start(10)
+        baseline = tracemalloc.take_snapshot() if trace_memory else None
+
+        stacks = StackCounter()
+        samples = 0
+        own_thread = threading.get_ident()
+        deadline = time.monotonic() + seconds
+        try:
+            while time.monotonic() < deadline:
+                for thread_id, frame in sys._current_frames().items():
+                    if thread_id == own_thread:
+                        continue
+                    stack = []
+                    while frame is not None:
+                        code = frame.f_code
+                        stack.append(
+                            f"{os.path.basename(code.co_filename)}:{code.co_name}"
+                        )
+                        frame = frame.f_back
+                    stacks[";".join(reversed(stack))] += 1
+                samples += 1
+                time.sleep(sample_interval)
+
+            snapshot = tracemalloc.take_snapshot() if trace_memory else None
+        finally:
+            if started_tracing:
+                tracemalloc.stop()
+            with self.lock:
+                self.enabled = False
+                span_stats = dict(self.span_stats)
+
+        self._write_reports(stacks, samples, span_stats, baseline, snapshot)
+        self.finished_at = time.time()
+
+    def _write_reports(self, stacks, samples, span_stats, baseline, snapshot):
+        os.makedirs(self.report_dir, exist_ok=True)
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+
+        # 折叠栈格式，可直接交给 flamegraph.pl / speedscope
+        with open(
+            os.path.join(self.report_dir, f"cpu-{stamp}.folded"), "w", encoding="utf-8"
+        ) as f:
+            for stack, count in stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+        with open(
+            os.path.join(self.report_dir, f"spans-{stamp}.txt"), "w", encoding="utf-8"
+        ) as f:
+            f.write(f"采样次数: {samples}\n")
+            f.write(f"{'阶段':<20}{'次数':>10}{'总耗时(ms)':>14}")
+            f.write(f"{'平均(us)':>12}{'最大(ms)':>12}\n")
+            for stage, (count, total, worst) in sorted(
+                span_stats.items(), key=lambda item: -item[1][1]
+            ):
+                f.write(
+                    f"{stage:<20}{count:>10}{total * 1000:>14.2f}"
+                    f"{total / count * 1e6:>12.1f}{worst * 1000:>12.2f}\n"
+                )
+
+        if snapshot is not None:
+            with open(
+                os.path.join(self.report_dir, f"alloc-{stamp}.txt"),
+                "w",
+                encoding="utf-8",
+            ) as f:
+                f.write("分析期间内存增长最多的位置:\n")
+                for stat in snapshot.compare_to(baseline, "lineno")[:30]:
+                    f.write(f"{stat}\n")
+                f.write("\n当前占用内存最多的位置:\n")
+                for stat in snapshot.statistics("lineno")[:30]:
+                    f.write(f"{stat}\n")
+
+    def reports(self):
+        if not os.path.isdir(self.report_dir):
+            return []
+        return sorted(os.listdir(self.report_dir), reverse=True)
+
+    # 只允许下载报告目录中的文件
+    def report_path(self, name):
+        if name != os.path.basename(name) or name not in self.reports():
+            return None
+        return os.path.join(self.report_dir, name)
@@ -1,17 +1,160 @@
-import sys
-from PyQt5.QtWidgets import QApplication
-from server_gui import ServerWindow
-from server_network import EnhancedServerNetwork as ServerNetwork
+"""无界面服务器入口，不导入 PyQt
 
+    python server/server.py --config server.json --port 8080
+    python server/server.py --console    # 同时打开附加到本服务器的控制台
 
-class ServerApp:
-    def __init__(self):
-        self.gui = ServerWindow()
-        self.network = ServerNetwork("0.0.0.0", 8080, self.gui)
+控制台也可以单独运行并附加到已在运行的服务器，见 server_gui.py。
+Ctrl+C 或 SIGTERM 时先排空：通知客户端按服务器建议的延迟重连，写完发送队列再退出。
+设置 handoff_path 后可以热重启，见 handoff.py。
+"""
+
+import logging
+import signal
+import socket
+import threading
+
+from config import (
+    DISCOVERY_OPTIONS,
+    LOG_OPTIONS,
+    MAILBOX_OPTIONS,
+    build_parser,
+    resolve_config,
+)
+from discovery import DiscoveryResponder
+from handoff import HandoffListener, request_takeover
+from log_pipeline import setup_logging, shutdown_logging
+from offline_mailbox import MailboxStore
+from server_network import EnhancedServerNetwork
+
+logger = logging.getLogger("im.server")
+
+
+# 返回 (network, handoff)；takeover 为 True 时从 handoff_path 上的旧进程接管
+# network_kwargs 原样传给 EnhancedServerNetwork，供集群（bus）和联邦（federation）入口使用
+def start_server(config, takeover=False, **network_kwargs):
+    config = dict(config)
+    log_config = {name: config.pop(name) for name in LOG_OPTIONS}
+    setup_logging(
+        log_config["log_level"],
+        log_config["log_file"],
+        log_config["log_max_bytes"],
+        log_config["log_backup_count"],
+        log_config["log_format"],
+        log_config["log_debug_sample"],
+        log_config["log_debug_rate"],
+    )
+    handoff_path = config.pop("handoff_path")
+    inherited = None
+    if takeover:
+        # 先接管再读离线信箱：旧进程交出前会把信箱写盘
+        inherited = request_takeover(handoff_path)
+        config.update(
+            listen_socket=inherited.listen_socket,
+            web_socket=inherited.web_socket,
+            state=inherited.state,
+        )
+    mailbox_config = {name: config.pop(name) for name in MAILBOX_OPTIONS}
+    mailbox = MailboxStore(
+        mailbox_config["mailbox_path"] or None,
+        mailbox_config["mailbox_ttl"],
+        mailbox_config["mailbox_max_messages"],
+        mailbox_config["mailbox_max_bytes"],
+    )
+    discovery_config = {name: config.pop(name) for name in DISCOVERY_OPTIONS}
+    host = config.pop("host")
+    port = config.pop("port")
+    network = EnhancedServerNetwork(
+        host, port, None, mailbox=mailbox, **config, **network_kwargs
+    )
+    if discovery_config["discovery_port"]:
+        try:
+            DiscoveryResponder(
+                network,
+                config["web_port"],
+                discovery_config["discovery_port"],
+                discovery_config["discovery_group"],
+                discovery_config["discovery_interface"],
+            ).start()
+        except OSError as e:
+            # 发现只是辅助功能，端口被占用时服务器照常运行
+            logger.warning("局域网发现启动失败: %s", e)
+
+    handoff = None
+    if handoff_path:
+        if hasattr(socket, "send_fds"):
+            handoff = HandoffListener(network, handoff_path).start()
+        else:
+            logger.warning("当前平台不支持传递文件描述符，热重启不可用")
+    if inherited is not None:
+        inherited.adopt(network)
+        inherited.ready()
+    return network, handoff
+
+
+# 无控制台、无热重启时的主循环：等到 Ctrl+C 或 SIGTERM，再排空并写盘离线信箱
+def serve(network):
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+    try:
+        while not stop.wait(1):
+            pass
+    except KeyboardInterrupt:
+        pass
+    finally:
+        network.drain("服务器正在关闭")
+        logger.info("服务器已停止（%s 端口）", network.port)
+        network.mailbox.flush()
+        shutdown_logging()
+
+
+def main(argv=None):
+    parser = build_parser()
+    parser.add_argument(
+        "--console", action="store_true", help="同时打开图形控制台（需要 PyQt5）"
+    )
+    parser.add_argument(
+        "--takeover",
+        action="store_true",
+        help="从 handoff_path 上正在运行的旧进程接管监听端口和连接（热重启）",
+    )
+    args = parser.parse_args(argv)
+    config = resolve_config(args)
+    if args.takeover and not config["handoff_path"]:
+        parser.error("--takeover 需要同时指定 --handoff-path")
+    network, handoff = start_server(config, args.takeover)
+
+    status = 0
+    stop = threading.Event()
+    if handoff is not None:
+        stop = handoff.done
+    try:
+        if args.console:
+            # 只有需要控制台时才导入 PyQt；关闭控制台窗口即停止服务器
+            from server_gui import run_console
+
+            web_host = config["web_host"]
+            if web_host in ("0.0.0.0", ""):
+                web_host = "127.0.0.1"
+            status = run_console(
+                f"http://{web_host}:{config['web_port']}", config["admin_token"]
+            )
+        else:
+            # Qt 事件循环不会检查 stop，控制台模式下 SIGTERM 保持默认行为
+            signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+            while not stop.wait(1):
+                pass
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if handoff is not None and handoff.handed_over:
+            logger.info("已交给新进程，旧进程退出")
+        else:
+            network.drain("服务器正在关闭")
+            logger.info("服务器已停止（%s 端口）", network.port)
+        network.mailbox.flush()
+        shutdown_logging()
+    return status
 
 
 if __name__ == "__main__":
-    app = QApplication(sys.argv)
-    server = ServerApp()
-    server.gui.show()
-    sys.exit(app.exec_())
+    raise SystemExit(main())
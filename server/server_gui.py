@@ -1,19 +1,150 @@
-from PyQt5.QtWidgets import QMainWindow, QTextEdit, QLabel
+"""服务器图形控制台：通过管理接口附加到正在运行的服务器
+
+python server/server_gui.py --url http://127.0.0.1:8081 [--token 令牌]
+"""
+
+import argparse
+import json
+import sys
+import threading
+import urllib.request
+from datetime import datetime
+
+from PyQt5 import QtCore
+from PyQt5.QtCore import pyqtSignal
+from PyQt5.QtWidgets import QApplication, QMainWindow, QTextEdit, QLabel, QPushButton
+
+# 轮询服务器状态和日志的间隔（毫秒），日志按批次追加到界面
+POLL_INTERVAL = 1000
+# 控制台最多保留的日志行数，超出后自动丢弃最早的行
+MAX_CONSOLE_LINES = 5000
 
 
 class ServerWindow(QMainWindow):
-    def __init__(self):
+    status_signal = pyqtSignal(dict)
+    logs_signal = pyqtSignal(dict)
+    error_signal = pyqtSignal(str)
+
+    def __init__(self, url, admin_token=None):
         super().__init__()
-        self.setWindowTitle("服务器控制台")
+        self.url = url.rstrip("/")
+        self.admin_token = admin_token
+        self.setWindowTitle(f"服务器控制台 - {self.url}")
         self.setGeometry(100, 100, 600, 400)
 
         self.log_display = QTextEdit(self)
         self.log_display.setGeometry(20, 20, 560, 300)
         self.log_display.setReadOnly(True)
+        self.log_display.document().setMaximumBlockCount(MAX_CONSOLE_LINES)
+
+        self.status_label = QLabel("服务器状态：连接中", self)
+        self.status_label.setGeometry(20, 330, 430, 30)
+
+        # 性能分析：在限定时间内开启CPU采样和内存快照
+        self.profile_btn = QPushButton("性能分析(30秒)", self)
+        self.profile_btn.setGeometry(460, 330, 120, 30)
+        self.profile_btn.clicked.connect(self._on_profile_clicked)
+
+        self.users = None
+        self.polling = False
+        self.log_index = 0
+        self.status_signal.connect(self._update_status)
+        self.logs_signal.connect(self._append_logs)
+        self.error_signal.connect(self._show_error)
+
+        # 请求在后台线程中进行，避免服务器无响应时界面卡住
+        self.poll_timer = QtCore.QTimer(self)
+        self.poll_timer.timeout.connect(self._poll)
+        self.poll_timer.start(POLL_INTERVAL)
+        self._poll()
+
+    def _request(self, path, method="GET"):
+        request = urllib.request.Request(self.url + path, method=method)
+        if self.admin_token:
+            request.add_header("X-Admin-Token", self.admin_token)
+        with urllib.request.urlopen(request, timeout=5) as response:
+            return json.loads(response.read().decode("utf-8"))
+
+    def _poll(self):
+        if self.polling:
+            return
+        self.polling = True
+        threading.Thread(target=self._fetch_status, daemon=True).start()
 
-        self.status_label = QLabel("服务器状态：运行中", self)
-        self.status_label.setGeometry(20, 330, 200, 30)
+    def _fetch_status(self):
+        try:
+            self.status_signal.emit(self._request("/admin/status"))
+            self.logs_signal.emit(self._request(f"/admin/logs?since={self.log_index}"))
+        except Exception as e:
+            self.error_signal.emit(f"服务器状态：无法连接（{str(e)}）")
+        finally:
+            self.polling = False
+
+    def _update_status(self, status):
+        minutes = int(status["uptime"] // 60)
+        text = (
+            f"服务器状态：运行中 · {status['connections']} 个连接 · "
+            f"{len(status['rooms'])} 个房间 · 已运行 {minutes} 分钟"
+        )
+        if status["profiling"]:
+            text += " · 性能分析中"
+        self.status_label.setText(text)
+
+        # 根据两次轮询之间的用户列表差异记录上下线
+        users = {f"{user['nickname']} ({user['ip']})" for user in status["users"]}
+        if self.users is None:
+            self.log_message(f"已附加到服务器 {self.url}，在线 {len(users)} 人")
+        else:
+            for user in sorted(users - self.users):
+                self.log_message(f"用户上线: {user}")
+            for user in sorted(self.users - users):
+                self.log_message(f"用户下线: {user}")
+        self.users = users
+
+    # 一次轮询拿到的所有日志行合并为一次追加，避免逐行刷新界面
+    def _append_logs(self, logs):
+        if logs["next"] < self.log_index:
+            # 服务器已重启，下次从头拉取
+            self.log_index = 0
+            return
+        lines = logs["lines"]
+        if logs["truncated"] and self.log_index:
+            lines = ["……（部分日志已被覆盖）"] + lines
+        self.log_index = logs["next"]
+        if lines:
+            self.log_display.append("\n".join(lines))
+
+    def _show_error(self, text):
+        self.status_label.setText(text)
+
+    def _on_profile_clicked(self):
+        def start_profile():
+            try:
+                result = self._request("/admin/profile?seconds=30", method="POST")
+                if not result["started"]:
+                    self.error_signal.emit("服务器状态：性能分析已在运行")
+            except Exception as e:
+                self.error_signal.emit(f"性能分析启动失败: {str(e)}")
+
+        threading.Thread(target=start_profile, daemon=True).start()
 
     def log_message(self, message):
         formatted_msg = f"[{datetime.now().strftime('%H:%M:%S')}] {message}"
         self.log_display.append(formatted_msg)
+
+
+def run_console(url, admin_token=None):
+    app = QApplication.instance() or QApplication(sys.argv)
+    window = ServerWindow(url, admin_token)
+    window.show()
+    return app.exec_()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="服务器图形控制台")
+    parser.add_argument(
+        "--url", default="http://127.0.0.1:8081", help="服务器网页端口地址"
+    )
+    parser.add_argument("--token", help="管理接口令牌")
+    args = parser.parse_args()
+    sys.exit(run_console(args.url, args.token))
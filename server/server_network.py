@@ -1,24 +1,207 @@
 import socket
+import hmac
 import json
+import logging
+import queue
+import random
+import select
+import shutil
 import threading
-from collections import defaultdict
+import time
+from collections import Counter, OrderedDict, deque
 from datetime import datetime
 import os
 from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
-from urllib.parse import parse_qs
+from urllib.parse import parse_qs, unquote, urlparse
+
+from file_store import DEFAULT_QUOTA, FileStore, valid_file_name
+from log_pipeline import recent_logs
+from metrics import MetricsRegistry
+from profiling import Profiler
+from timer_wheel import TimerWheel
+from traffic_capture import TrafficRecorder
+
+# 帧分隔符：客户端与服务器之间的每个 JSON 帧都以它结尾
+FRAME_DELIMITER = b"<END_OF_JSON>"
+# 用于断线续传的消息历史环形缓冲区大小
+HISTORY_SIZE = 1000
+# 每个房间单独保留的历史消息数量
+ROOM_HISTORY_SIZE = 200
+# 房间名最大长度
+MAX_ROOM_NAME = 64
+# 没有成员的房间最多保留多少个（含历史），超出时淘汰最久未使用的空房间
+MAX_IDLE_ROOMS = 1000
+# 服务器最多记住的会话数量（用于去重客户端重发的离线消息）
+MAX_SESSIONS = 10000
+# 客户端心跳间隔（秒），通过 welcome 下发给客户端
+HEARTBEAT_INTERVAL = 15
+# 超过该时间没有收到任何数据的连接视为已失效
+IDLE_TIMEOUT = 45
+# 每个连接的发送队列长度，队列满说明对端已无法及时接收
+OUTBOUND_QUEUE_SIZE = 1000
+# 监听队列长度；热重启交接期间新连接在这里排队，而不是被拒绝
+LISTEN_BACKLOG = 128
+# 接受连接线程检查停止标志的间隔（秒）
+ACCEPT_POLL = 0.5
+# 启用连接交接时，读线程检查暂停标志的间隔（秒）
+PARK_INTERVAL = 0.5
+# 排空时建议客户端重连的时间窗口（秒），每个客户端在窗口内随机分配延迟，避免同时重连
+RECONNECT_WINDOW = 10.0
+# 排空时等待发送队列写完的最长时间（秒）
+DRAIN_TIMEOUT = 10.0
+# 热重启后新进程的序号从旧进程的位置再跳过这么多，
+# 交接瞬间旧进程仍在处理的消息不会与新进程分配的序号冲突
+HANDOFF_SEQ_GAP = 1000
+# 指标按消息类型分组，未知类型统一记为 other，防止标签数量失控
+METRIC_MESSAGE_TYPES = {
+    "hello",
+    "ping",
+    "message",
+    "file",
+    "user_update",
+    "get_user_list",
+    "join",
+    "leave",
+    "welcome",
+    "resume",
+    "ack",
+    "pong",
+    "file_ack",
+    "system",
+    "user_list",
+    "room_joined",
+    "room_left",
+    "room_history",
+    "mailbox",
+    "reconnect",
+}
+FILE_SECONDS_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+logger = logging.getLogger("im.network")
+
+
+def encode_frame(message):
+    return json.dumps(message, ensure_ascii=False).encode("utf-8") + FRAME_DELIMITER
+
+
+def valid_room(room):
+    return isinstance(room, str) and 0 < len(room) <= MAX_ROOM_NAME
 
 
 class ServerNetwork:
-    def __init__(self, host, port, gui):
+    def __init__(
+        self,
+        host,
+        port,
+        gui,
+        history_size=HISTORY_SIZE,
+        heartbeat_interval=HEARTBEAT_INTERVAL,
+        idle_timeout=IDLE_TIMEOUT,
+        capture_path=None,
+        capture_anonymize=False,
+        reuse_port=False,
+        bus=None,
+        federation=None,
+        mailbox=None,
+        files_dir="received_files",
+        files_quota=DEFAULT_QUOTA,
+        files_max_age=None,
+        profile_dir="profiles",
+        outbound_queue_size=OUTBOUND_QUEUE_SIZE,
+        reconnect_window=RECONNECT_WINDOW,
+        drain_timeout=DRAIN_TIMEOUT,
+        handoff_connections=False,
+        listen_socket=None,
+        state=None,
+    ):
         self.host = host
         self.port = port
         self.gui = gui
-        self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.clients = defaultdict(dict)  # {ip: {"socket": obj, "nickname": str}}
+        # 接收文件目录：上传前预留配额，后台按 LRU/过期清理
+        self.file_store = FileStore(files_dir, files_quota, files_max_age or None)
+        self.outbound_queue_size = outbound_queue_size
+        self.started_at = time.time()
+        self.reconnect_window = reconnect_window
+        self.drain_timeout = drain_timeout
+        # 排空/交接状态：不再接受新连接，也不再处理客户端发来的消息
+        self.accepting = True
+        self.draining = False
+        # 连接交接：读线程在帧边界处暂停，把未处理完的缓冲登记到 parked
+        self.handoff_connections = handoff_connections
+        self.parking = threading.Event()
+        self.parked = {}
+        self.park_cond = threading.Condition()
+        if listen_socket is not None:
+            # 热重启：沿用旧进程交过来的监听socket，不重新绑定
+            self.server_socket = listen_socket
+        else:
+            self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        if reuse_port:
+            # 多进程模式：多个工作进程共享同一个监听端口，由内核分配连接
+            self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        # {client_key: {"socket": obj, "nickname": str, "ip": str, "session_id": str}}
+        self.clients = {}
+        self.clients_lock = threading.Lock()
+        # 在线昵称 -> 连接数，随 clients 一起在 clients_lock 内维护，私聊判断在线不必遍历连接
+        self.nicknames = Counter()
+
+        # 会话状态：{session_id: {"last_client_seq": int}}，断线后依然保留
+        self.sessions = OrderedDict()
+        self.sessions_lock = threading.Lock()
+
+        # 每个服务器进程的纪元标识，客户端据此判断序号是否还有效
+        self.epoch = f"{int(time.time() * 1000):x}"
+        self.seq = 0
+        self.seq_lock = threading.Lock()
+        self.history = deque(maxlen=history_size)
+
+        # 房间：{room: {"members": set(session_id), "history": deque}}
+        # 房间消息只投递给订阅该房间的会话，并写入房间自己的历史，不进入全局历史
+        self.rooms = OrderedDict()
+        self.rooms_lock = threading.Lock()
+        # 已握手会话当前所在的连接：{session_id: client_key}
+        self.session_keys = {}
+
+        # 多进程模式下的本地消息总线（见 cluster.py），由总线统一分配序号和纪元
+        self.bus = bus
+        self.remote_users = []
+        self.remote_nicknames = set()
+        if bus is not None:
+            self.epoch = bus.epoch
+        # 跨服务器节点的联邦链路（见 federation.py）
+        self.federation = federation
+        # 离线私聊信箱（见 offline_mailbox.py），接收者上线握手时一次性下发
+        self.mailbox = mailbox
+
+        self.metrics = MetricsRegistry()
+        self.init_metrics()
+        # 按需开启的性能分析，关闭时 span 几乎没有开销
+        self.profiler = Profiler(report_dir=profile_dir, metrics=self.metrics)
+
+        # 可选的流量录制，用于复现线上的突发流量
+        self.recorder = None
+        if capture_path:
+            self.recorder = TrafficRecorder(capture_path, anonymize=capture_anonymize)
+
+        # 心跳超时检测：时间轮每个刻度只检查一个槽
+        self.heartbeat_interval = heartbeat_interval
+        self.idle_timeout = idle_timeout
+        self.idle_wheel = TimerWheel(tick=1.0)
+        self.heartbeat_thread = threading.Thread(
+            target=self.evict_idle_clients, daemon=True
+        )
+        self.heartbeat_thread.start()
+
+        # 旧进程交接过来的纪元、序号和历史，客户端重连后可以继续补发
+        if state is not None:
+            self.restore_state(state)
 
         # 绑定服务器
-        self.server_socket.bind((self.host, self.port))
-        self.server_socket.listen(5)
+        if listen_socket is None:
+            self.server_socket.bind((self.host, self.port))
+            self.server_socket.listen(LISTEN_BACKLOG)
+        # 非阻塞：交接期间新旧进程共用监听socket，可读之后连接可能已被另一方取走
+        self.server_socket.setblocking(False)
 
         # 启动接受连接线程
         self.accept_thread = threading.Thread(
@@ -26,21 +209,169 @@ class ServerNetwork:
         )
         self.accept_thread.start()
 
+        if bus is not None:
+            bus.attach(self)
+        if federation is not None:
+            federation.attach(self)
+
+    # 热路径上只做加锁计数；会话数、队列深度等在采集时才计算
+    def init_metrics(self):
+        registry = self.metrics
+        self.messages_in = registry.counter(
+            "im_messages_in_total", "收到的帧数", labels=("type",)
+        )
+        self.bytes_in = registry.counter(
+            "im_bytes_in_total", "收到的帧字节数", labels=("type",)
+        )
+        self.messages_out = registry.counter(
+            "im_messages_out_total", "放入发送队列的帧数", labels=("type",)
+        )
+        self.bytes_out = registry.counter(
+            "im_bytes_out_total", "放入发送队列的字节数", labels=("type",)
+        )
+        self.file_bytes = registry.counter(
+            "im_file_bytes_received_total", "收到的文件字节数"
+        )
+        self.file_seconds = registry.histogram(
+            "im_file_transfer_seconds", "单个文件的接收耗时", FILE_SECONDS_BUCKETS
+        )
+        self.fanout_seconds = registry.histogram(
+            "im_fanout_seconds", "一条聊天消息放入所有接收者发送队列的耗时"
+        )
+        self.send_seconds = registry.histogram(
+            "im_send_latency_seconds", "帧从入队到写入socket的耗时"
+        )
+        self.evictions = registry.counter(
+            "im_evictions_total", "被服务器断开的连接数", labels=("reason",)
+        )
+        registry.callback_gauge(
+            "im_connected_sessions", "当前连接数", lambda: len(self.clients)
+        )
+        registry.callback_gauge(
+            "im_outbound_queue_depth",
+            "所有连接发送队列中等待帧数的最大值和总和",
+            self._queue_depth_stats,
+            labels=("stat",),
+        )
+        registry.callback_gauge("im_rooms", "当前房间数", lambda: len(self.rooms))
+        registry.callback_gauge(
+            "im_file_store",
+            "接收文件目录的配额、占用、预留、文件数和累计清理/拒绝数",
+            lambda: {(k,): v for k, v in self.file_store.stats().items()},
+            labels=("stat",),
+        )
+        if self.mailbox is not None:
+            registry.callback_gauge(
+                "im_mailbox",
+                "离线信箱的用户数、消息数、字节数和累计淘汰数",
+                lambda: {(k,): v for k, v in self.mailbox.stats().items()},
+                labels=("stat",),
+            )
+
+    # 只导出汇总值：按连接分标签会暴露客户端地址，且每次重连都新增一条序列
+    def _queue_depth_stats(self):
+        depths = [client["outbound"].qsize() for client in list(self.clients.values())]
+        return {("max",): max(depths, default=0), ("sum",): sum(depths)}
+
+    def _metric_type(self, msg_type):
+        return msg_type if msg_type in METRIC_MESSAGE_TYPES else "other"
+
+    def _count_sent(self, msg_type, size, count):
+        if count:
+            msg_type = self._metric_type(msg_type)
+            self.messages_out.inc(count, msg_type)
+            self.bytes_out.inc(size * count, msg_type)
+
     def accept_connections(self):
+        while self.accepting:
+            try:
+                readable, _, _ = select.select(
+                    [self.server_socket], [], [], ACCEPT_POLL
+                )
+                if not readable:
+                    continue
+                client_socket, addr = self.server_socket.accept()
+            except BlockingIOError:
+                continue
+            except (OSError, ValueError):
+                # 监听socket已关闭
+                break
+            client_socket.setblocking(True)
+            # 同一IP可能有多个客户端，使用 ip:port 区分连接
+            self.add_connection(client_socket, f"{addr[0]}:{addr[1]}", addr[0])
+
+    # 登记连接并启动读写线程；交接过来的连接带着会话信息和未处理完的缓冲
+    def add_connection(
+        self,
+        client_socket,
+        key,
+        ip,
+        buffer=b"",
+        nickname="新用户",
+        session_id=None,
+        rooms=(),
+    ):
+        client = {
+            "socket": client_socket,
+            "nickname": nickname,
+            "ip": ip,
+            "session_id": session_id,
+            "rooms": set(),
+            "outbound": queue.Queue(maxsize=self.outbound_queue_size),
+        }
+        with self.clients_lock:
+            self.clients[key] = client
+            self.nicknames[nickname] += 1
+        if session_id is not None:
+            self.session_keys[session_id] = key
+            for room in rooms:
+                self._add_member(client, room)
+        if self.recorder:
+            self.recorder.record_open(key)
+        self.idle_wheel.schedule(key, self.idle_timeout)
+
+        # 启动客户端处理线程和发送线程
+        client_thread = threading.Thread(
+            target=self.handle_client, args=(client_socket, key, buffer), daemon=True
+        )
+        client_thread.start()
+        client["writer"] = threading.Thread(
+            target=self.write_client, args=(key, client), daemon=True
+        )
+        client["writer"].start()
+        return client
+
+    # 发送线程：慢速或已失效的对端只会阻塞自己的队列，不影响广播
+    def write_client(self, key, client):
+        outbound = client["outbound"]
         while True:
-            client_socket, addr = self.server_socket.accept()
-            ip = addr[0]
-            self.clients[ip]["socket"] = client_socket
-            self.clients[ip]["nickname"] = "新用户"
-
-            # 启动客户端处理线程
-            client_thread = threading.Thread(
-                target=self.handle_client, args=(client_socket, ip), daemon=True
-            )
-            client_thread.start()
+            item = outbound.get()
+            if item is None:
+                break
+            data, enqueued_at = item
+            try:
+                with self.profiler.span("socket_send"):
+                    client["socket"].sendall(data)
+                self.send_seconds.observe(time.perf_counter() - enqueued_at)
+            except OSError as e:
+                logger.warning("发送失败至 %s，错误：%s", key, e)
+                self.remove_client(key)
+                break
 
-            # 更新用户列表
-            self.broadcast_user_list()
+    # 时间轮到期的连接在超时时间内没有任何数据（包括心跳），判定为失效
+    # 同一刻度到期的连接全部移除后只广播一次在线列表
+    def evict_idle_clients(self):
+        while True:
+            time.sleep(self.idle_wheel.tick)
+            evicted = 0
+            for key in self.idle_wheel.advance():
+                if key in self.clients:
+                    logger.info("客户端 %s 心跳超时，断开连接", key)
+                    self.evictions.inc(1, "idle")
+                    self.remove_client(key, notify=False)
+                    evicted += 1
+            if evicted:
+                self.broadcast_user_list()
 
     def validate_message(self, message):
         type_map = {
@@ -52,143 +383,721 @@ class ServerNetwork:
             return False
         return all(field in message for field in type_map[message["type"]])
 
-    def handle_client(self, client_socket, ip):
-        buffer = b""
-        while True:
-            try:
+    def handle_client(self, client_socket, key, buffer=b""):
+        parked = False
+        # 启用连接交接时先等待可读，期间检查暂停标志，保证在帧边界处停下
+        poller = None
+        if self.handoff_connections:
+            poller = select.poll()
+            poller.register(client_socket, select.POLLIN)
+        try:
+            while True:
+                if poller is not None:
+                    ready = poller.poll(PARK_INTERVAL * 1000)
+                    if self.parking.is_set():
+                        parked = True
+                        self._park(key, buffer)
+                        return
+                    if not ready:
+                        continue
                 data = client_socket.recv(4096)
                 if not data:
                     break
 
                 buffer += data
+                self.idle_wheel.touch(key, self.idle_timeout)
 
-                # 处理文件元数据
-                if b"<END_OF_JSON>" in buffer:
-                    # 分离元数据和文件内容
-                    meta_part, file_data = buffer.split(b"<END_OF_JSON>", 1)
-                    meta = json.loads(meta_part.decode())
-
-                    if meta["type"] == "file":
-                        # 发送确认
-                        client_socket.send(b"ACK")
-
-                        # 准备接收文件
-                        file_path = os.path.join("received_files", meta["file_name"])
-                        os.makedirs("received_files", exist_ok=True)
-
-                        received_size = 0
-                        with open(file_path, "wb") as f:
-                            f.write(file_data)
-                            received_size += len(file_data)
-
-                            # 继续接收剩余文件内容
-                            while received_size < meta["file_size"]:
-                                chunk = client_socket.recv(4096)
-                                if not chunk:
-                                    break
-                                f.write(chunk)
-                                received_size += len(chunk)
-
-                        # 广播文件接收完成
-                        notification = {
-                            "type": "system",
-                            "content": f"文件 {meta['file_name']} 已成功接收",
-                            "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                        }
-                        self.broadcast(notification, exclude=ip)
-
-                        buffer = b""
+                # 一次接收可能包含多个帧，逐帧处理
+                while FRAME_DELIMITER in buffer:
+                    meta_part, buffer = buffer.split(FRAME_DELIMITER, 1)
+                    with self.profiler.span("json_decode"):
+                        meta = json.loads(meta_part.decode())
+                    msg_type = self._metric_type(meta.get("type"))
+                    self.messages_in.inc(1, msg_type)
+                    self.bytes_in.inc(len(meta_part) + len(FRAME_DELIMITER), msg_type)
+                    if self.recorder:
+                        self.recorder.record_frame(key, meta)
 
+                    if meta.get("type") == "file":
+                        with self.profiler.span("receive_file"):
+                            buffer = self.receive_file(client_socket, key, meta, buffer)
+                        if buffer is None:
+                            return
                     else:
                         # 处理其他消息类型
-                        self.handle_normal_message(client_socket, meta)
-                        buffer = b""
+                        with self.profiler.span("handle_client"):
+                            self.handle_normal_message(key, meta)
 
-            except Exception as e:
-                print(f"处理客户端 {ip} 时出错: {str(e)}")
-                break
+        except Exception as e:
+            logger.warning("处理客户端 %s 时出错: %s", key, e)
+        finally:
+            # 暂停的连接交给新进程，不能关闭
+            if not parked:
+                self.remove_client(key)
+
+    # 接收文件内容，返回文件之后剩余的缓冲数据；连接中断时返回 None
+    def receive_file(self, client_socket, key, meta, buffer):
+        file_name = os.path.basename(str(meta["file_name"]))
+        file_size = meta["file_size"]
+        # 先预留空间，不够时在客户端发送文件内容之前就拒绝
+        reservation = None
+        if (
+            not self.draining
+            and valid_file_name(file_name)
+            and isinstance(file_size, int)
+            and file_size >= 0
+        ):
+            reservation = self.file_store.reserve(file_name, file_size)
+        if reservation is None:
+            logger.warning("拒绝 %s 上传文件 %s（%s 字节）", key, file_name, file_size)
+            if self.draining:
+                reason = "服务器正在重启，请稍后重试"
+            else:
+                reason = "服务器存储空间不足或文件信息无效"
+            self.send_to_client(
+                key,
+                {
+                    "type": "file_reject",
+                    "file_name": meta["file_name"],
+                    "reason": reason,
+                },
+            )
+            return buffer
+
+        # 发送确认
+        self.send_to_client(key, {"type": "file_ack", "file_name": meta["file_name"]})
+
+        started = time.perf_counter()
+        file_data, buffer = buffer[:file_size], buffer[file_size:]
+        received_size = 0
+        try:
+            with open(reservation.temp_path, "wb") as f:
+                f.write(file_data)
+                received_size += len(file_data)
+
+                # 继续接收剩余文件内容
+                while received_size < file_size:
+                    chunk = client_socket.recv(min(4096, file_size - received_size))
+                    if not chunk:
+                        return None
+                    f.write(chunk)
+                    received_size += len(chunk)
+                    self.idle_wheel.touch(key, self.idle_timeout)
+            reservation.commit()
+        finally:
+            # 连接中断或写入失败时删除临时文件并释放预留
+            reservation.abort()
+
+        self.file_bytes.inc(received_size)
+        self.file_seconds.observe(time.perf_counter() - started)
+        if self.recorder:
+            self.recorder.record_file_data(key, received_size)
+
+        # 广播文件接收完成
+        notification = {
+            "type": "system",
+            "content": f"文件 {file_name} 已成功接收",
+            "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        }
+        self.broadcast(notification, exclude=key)
+        return buffer
+
+    def handle_normal_message(self, key, meta):
+        msg_type = meta.get("type")
+        if msg_type == "ping":
+            self.send_to_client(key, {"type": "pong"})
+        elif self.draining:
+            # 排空期间不处理也不确认，消息留在客户端发件箱中，重连后重发
+            logger.debug("排空中，忽略 %s 的 %s 帧", key, msg_type)
+        elif msg_type == "hello":
+            self.register_session(key, meta)
+        elif msg_type == "message":
+            client = self.clients.get(key)
+            if client is None:
+                return
+            client_seq = meta.get("client_seq")
+            if client_seq is not None and not self._accept_client_seq(
+                client["session_id"], client_seq
+            ):
+                # 重连后离线发件箱重发的消息，已经处理过，只补发确认
+                self.send_to_client(key, {"type": "ack", "client_seq": client_seq})
+                return
+            self.route_message(meta, session_id=client["session_id"])
+            if client_seq is not None:
+                self.send_to_client(key, {"type": "ack", "client_seq": client_seq})
+        elif msg_type == "user_update":
+            # 改名不取信箱：昵称没有认证，信箱只在握手时下发
+            self._set_nickname(key, meta.get("nickname", "新用户"))
+            self.broadcast_user_list()
+        elif msg_type == "get_user_list":
+            self.send_to_client(key, self._user_list_message())
+        elif msg_type == "join":
+            self.join_room(key, meta.get("room"))
+        elif msg_type == "leave":
+            self.leave_room(key, meta.get("room"))
+        else:
+            logger.warning("丢弃未知类型消息: %s", meta)
+
+    # 客户端握手：登记会话并补发断线期间错过的消息
+    def register_session(self, key, hello):
+        client = self.clients.get(key)
+        if client is None:
+            return
+        session_id = hello.get("session_id") or key
+        nickname = hello.get("nickname", client["nickname"])
+
+        with self.sessions_lock:
+            session = self.sessions.setdefault(session_id, {"last_client_seq": 0})
+            self.sessions.move_to_end(session_id)
+            while len(self.sessions) > MAX_SESSIONS:
+                self.sessions.popitem(last=False)
+            last_client_seq = session["last_client_seq"]
+
+        # welcome 和 resume 在 seq_lock 内入队，之后才登记为已握手：
+        # 之前分配序号的消息都在 resume 里，之后的消息都排在 resume 之后
+        missed = []
+        with self.seq_lock:
+            self.send_to_client(
+                key,
+                {
+                    "type": "welcome",
+                    "epoch": self.epoch,
+                    "seq": self.seq,
+                    "last_client_seq": last_client_seq,
+                    "heartbeat_interval": self.heartbeat_interval,
+                },
+            )
+            rooms = [room for room in hello.get("rooms", []) if valid_room(room)]
+            # 只有同一纪元内的序号才有意义，服务器重启后不做补发
+            last_seq = hello.get("last_seq")
+            if hello.get("epoch") == self.epoch and last_seq is not None:
+                missed, complete = self.messages_since(last_seq, nickname, rooms)
+                self.send_to_client(
+                    key, {"type": "resume", "messages": missed, "complete": complete}
+                )
+
+            self._set_nickname(key, nickname)
+            client["session_id"] = session_id
+            self.session_keys[session_id] = key
+            # 重连时恢复之前订阅的房间
+            for room in rooms:
+                self._add_member(client, room)
+
+        self.deliver_mailbox(key, skip_seqs={message["seq"] for message in missed})
+        self.broadcast_user_list()
+
+    # 把该用户离线期间收到的私聊消息合并成一帧下发；已随 resume 补发的不再重复
+    # 只在 hello 握手时调用。昵称没有认证，用同一昵称握手的连接都能取走信箱
+    def deliver_mailbox(self, key, skip_seqs=()):
+        client = self.clients.get(key)
+        if self.mailbox is None or client is None:
+            return
+        messages = [
+            message
+            for message in self.mailbox.take(client["nickname"])
+            if message.get("seq") not in skip_seqs
+        ]
+        if messages:
+            self.send_to_client(key, {"type": "mailbox", "messages": messages})
+
+    # 检查客户端序号，返回 False 表示该消息已处理过
+    def _accept_client_seq(self, session_id, client_seq):
+        with self.sessions_lock:
+            session = self.sessions.get(session_id)
+            if session is None:
+                return True
+            if client_seq <= session["last_client_seq"]:
+                return False
+            session["last_client_seq"] = client_seq
+            return True
+
+    # 返回序号大于 last_seq 且对该用户可见的历史消息（含已订阅房间），以及历史是否完整覆盖缺口
+    # 调用方需持有 seq_lock
+    def messages_since(self, last_seq, nickname, rooms=()):
+        rings = [self.history]
+        with self.rooms_lock:
+            rings += [self._get_room(room)["history"] for room in rooms]
+        rings = [list(ring) for ring in rings]
+        # 环形缓冲区未满说明从未丢弃过消息
+        complete = all(
+            len(ring) < ring_size or ring[0]["seq"] <= last_seq + 1
+            for ring, ring_size in zip(
+                rings, [self.history.maxlen] + [ROOM_HISTORY_SIZE] * len(rooms)
+            )
+        )
+        missed = [
+            message
+            for ring in rings
+            for message in ring
+            if message["seq"] > last_seq and self._visible_to(message, nickname)
+        ]
+        missed.sort(key=lambda message: message["seq"])
+        return missed, complete
+
+    def _visible_to(self, message, nickname):
+        receiver = message.get("receiver", "all")
+        return receiver == "all" or nickname in (receiver, message.get("nickname"))
+
+    def _get_room(self, room):
+        entry = self.rooms.get(room)
+        if entry is None:
+            entry = self.rooms[room] = {
+                "members": set(),
+                "history": deque(maxlen=ROOM_HISTORY_SIZE),
+            }
+            idle = [name for name, other in self.rooms.items() if not other["members"]]
+            for name in idle[: max(0, len(idle) - MAX_IDLE_ROOMS)]:
+                del self.rooms[name]
+        self.rooms.move_to_end(room)
+        return entry
+
+    def _add_member(self, client, room):
+        if not valid_room(room):
+            return False
+        with self.rooms_lock:
+            self._get_room(room)["members"].add(client["session_id"])
+        client["rooms"].add(room)
+        return True
+
+    def join_room(self, key, room):
+        client = self.clients.get(key)
+        if client is None or client["session_id"] is None:
+            return
+        if not self._add_member(client, room):
+            self.send_to_client(key, {"type": "system", "content": "无效的房间名"})
+            return
+        with self.rooms_lock:
+            entry = self.rooms[room]
+            members = len(entry["members"])
+            history = list(entry["history"])
+        self.send_to_client(
+            key, {"type": "room_joined", "room": room, "members": members}
+        )
+        # 房间近期历史单独下发，不参与客户端的序号去重
+        self.send_to_client(
+            key, {"type": "room_history", "room": room, "messages": history}
+        )
+
+    def leave_room(self, key, room):
+        client = self.clients.get(key)
+        if client is None or room not in client["rooms"]:
+            return
+        self._remove_member(client, room)
+        self.send_to_client(key, {"type": "room_left", "room": room})
+
+    def _remove_member(self, client, room):
+        client["rooms"].discard(room)
+        with self.rooms_lock:
+            entry = self.rooms.get(room)
+            if entry is not None:
+                entry["members"].discard(client["session_id"])
 
-    def route_message(self, message):
+    def route_message(self, message, session_id=None):
         # 添加字段验证
         required_fields = ["type", "sender_ip", "nickname", "timestamp", "content"]
         if message.get("type") != "message" or not all(
             field in message for field in required_fields
         ):
-            print(f"丢弃无效消息: {message}")
+            logger.warning("丢弃无效消息: %s", message)
             return
+        # 房间名与 join_room 同样校验，不能经消息路径创建任意房间
+        if message.get("room") not in (None, "") and not valid_room(message["room"]):
+            logger.warning("丢弃房间名无效的消息: %s", message)
+            return
+
+        with self.profiler.span("route_message"):
+            if self.bus is not None:
+                # 经总线分配全局序号后，由总线回调 deliver_message 投递
+                self.bus.publish(message, session_id)
+            else:
+                self.deliver_message(message)
+            if self.federation is not None:
+                self.federation.publish(message)
+            # 私聊接收者不在线时存入信箱；只在收到消息的这个进程/节点存一份
+            receiver = message.get("receiver", "all")
+            if (
+                self.mailbox is not None
+                and receiver != "all"
+                and not message.get("room")
+                and not self.is_online(receiver)
+            ):
+                self.mailbox.put(receiver, message)
+
+    def is_online(self, nickname):
+        if self.nicknames[nickname] or nickname in self.remote_nicknames:
+            return True
+        return self.federation is not None and self.federation.is_online(nickname)
+
+    def _set_nickname(self, key, nickname):
+        with self.clients_lock:
+            client = self.clients.get(key)
+            if client is None:
+                return
+            self._forget_nickname(client["nickname"])
+            client["nickname"] = nickname
+            self.nicknames[nickname] += 1
+
+    # 从 clients 中摘下连接并更新昵称索引
+    def _pop_client(self, key):
+        with self.clients_lock:
+            client = self.clients.pop(key, None)
+            if client is not None:
+                self._forget_nickname(client["nickname"])
+        return client
+
+    def _forget_nickname(self, nickname):
+        self.nicknames[nickname] -= 1
+        if self.nicknames[nickname] <= 0:
+            del self.nicknames[nickname]
+
+    # 分配序号、写入历史并投递给所有可见的客户端；seq 由总线指定时直接使用
+    def deliver_message(self, message, seq=None):
+        started = time.perf_counter()
+        # 入队也在 seq_lock 内完成，每个接收者的发送队列里序号严格递增；
+        # 客户端按最大序号去重，乱序到达的小序号会被当作重复丢弃
+        evicted = []
+        sent = 0
+        with self.profiler.span("seq_lock_wait"):
+            self.seq_lock.acquire()
+        try:
+            self.seq = self.seq + 1 if seq is None else seq
+            message["seq"] = self.seq
+            room = message.get("room")
+            if room:
+                with self.rooms_lock:
+                    entry = self._get_room(room)
+                    entry["history"].append(message)
+                    members = list(entry["members"])
+            else:
+                self.history.append(message)
+
+            with self.profiler.span("json_encode"):
+                data = encode_frame(message)
+            if room:
+                # 房间消息按订阅索引投递，只发给房间成员
+                for session_id in members:
+                    key = self.session_keys.get(session_id)
+                    client = self.clients.get(key)
+                    if client is not None and self._send_raw(
+                        key, client, data, evicted
+                    ):
+                        sent += 1
+            else:
+                # 群聊广播给所有客户端（含发送者），私聊只发给接收者和发送者
+                for key, client in list(self.clients.items()):  # 使用list避免字典改变
+                    # 尚未完成握手的连接不参与广播，保证握手后的第一帧是 welcome
+                    if client["session_id"] is None:
+                        continue
+                    if not self._visible_to(message, client["nickname"]):
+                        continue
+                    if self._send_raw(key, client, data, evicted):
+                        sent += 1
+        finally:
+            self.seq_lock.release()
+        # 发送队列已满的连接在锁外移除，移除时还要广播在线列表
+        for key in evicted:
+            self.remove_client(key)
 
         # 将消息推送给网页端
-        if hasattr(self, "push_web_message"):
-            formatted_msg = json.dumps(
-                {
-                    "timestamp": message["timestamp"],
-                    "nickname": message["nickname"],
-                    "content": message["content"],
-                    "source": "client",
-                },
-                ensure_ascii=False,
+        if (
+            hasattr(self, "push_web_message")
+            and message.get("receiver", "all") == "all"
+        ):
+            with self.profiler.span("web_push"):
+                formatted_msg = json.dumps(
+                    {
+                        "timestamp": message["timestamp"],
+                        "nickname": message["nickname"],
+                        "content": message["content"],
+                        "source": (
+                            "web" if message.get("source") == "web" else "client"
+                        ),
+                    },
+                    ensure_ascii=False,
+                )
+                self.push_web_message(formatted_msg, room or None)
+
+        # 每条消息只记一行汇总，并经过采样限速，不再逐个接收者打印
+        if room:
+            logger.debug(
+                "房间 %s 消息 seq=%s 已投递给 %d 个成员", room, message["seq"], sent
             )
-            self.push_web_message(formatted_msg)
+        else:
+            logger.debug("消息 seq=%s 已投递给 %d 个客户端", message["seq"], sent)
+        self._count_sent("message", len(data), sent)
+        self.fanout_seconds.observe(time.perf_counter() - started)
 
-        # 广播给所有客户端（含发送者）
-        for ip, client in list(self.clients.items()):  # 使用list避免字典改变
-            try:
-                client["socket"].send(json.dumps(message).encode())
-                print(f"成功发送至 {ip}")
-            except Exception as e:
-                print(f"发送失败至 {ip}，错误：{str(e)}")
-                del self.clients[ip]
-
-    # def route_message(self, message):
-    #     if message["type"] not in ["message", "file", "user_update"]:
-    #         return
-    #     self.message_history.append(message)
-    #     if message["receiver"] == "all":
-    #         for client in self.clients.items():
-    #             try:
-    #                 client["socket"].send(json.dumps(message).encode())
-    #             except:
-    #                 self.remove_disconnected_client(client)
-    #             # if ip != message["sender_ip"]:
-    #             # client["socket"].send(json.dumps(message).encode())
-    #     else:
-    #         target_ip = next(
-    #             (
-    #                 ip
-    #                 for ip, info in self.clients.items()
-    #                 if info["nickname"] == message["receiver"]
-    #             ),
-    #             None,
-    #         )
-    #         if target_ip:
-    #             self.clients[target_ip]["socket"].send(json.dumps(message).encode())
-
-    #     # 日志信息
-    #     print(
-    #         f"Broadcasting to {len(self.clients)} clients: {message['content'][:20]}..."
-    #     )
+    def broadcast(self, message, exclude=None):
+        with self.profiler.span("broadcast"):
+            data = encode_frame(message)
+            sent = 0
+            for key, client in list(self.clients.items()):
+                if key != exclude and client["session_id"] is not None:
+                    sent += self._send_raw(key, client, data)
+        self._count_sent(message.get("type"), len(data), sent)
+
+    def send_to_client(self, key, message):
+        client = self.clients.get(key)
+        if client is None:
+            return False
+        data = encode_frame(message)
+        sent = self._send_raw(key, client, data)
+        self._count_sent(message.get("type"), len(data), sent)
+        return sent
+
+    # evicted 不为 None 时只记下队列已满的连接，由调用方在释放锁之后移除
+    def _send_raw(self, key, client, data, evicted=None):
+        try:
+            client["outbound"].put_nowait((data, time.perf_counter()))
+            return True
+        except queue.Full:
+            logger.warning("客户端 %s 发送队列已满，断开连接", key)
+            self.evictions.inc(1, "slow_consumer")
+            if evicted is None:
+                self.remove_client(key)
+            else:
+                evicted.append(key)
+            return False
+
+    # 移除断开连接的客户端；notify 为 False 时由调用方在批量移除后统一广播在线列表
+    def remove_client(self, key, notify=True):
+        client = self._pop_client(key)
+        if client is None:
+            return
+        self.idle_wheel.cancel(key)
+        if self.recorder:
+            self.recorder.record_close(key)
+        # 会话已经在新连接上重新握手时，房间订阅归新连接所有
+        session_id = client["session_id"]
+        if session_id is not None and self.session_keys.get(session_id) == key:
+            self.session_keys.pop(session_id, None)
+            for room in list(client["rooms"]):
+                self._remove_member(client, room)
+        # 通知发送线程退出；队列已满时直接关闭socket也会让它退出
+        try:
+            client["outbound"].put_nowait(None)
+        except queue.Full:
+            pass
+        try:
+            client["socket"].shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        try:
+            client["socket"].close()
+        except OSError:
+            pass
+        # 立即更新在线状态
+        if notify:
+            self.broadcast_user_list()
 
     # 处理断开连接的客户端
     def remove_disconnected_client(self, client):
-        for ip, info in list(self.clients.items()):
+        for key, info in list(self.clients.items()):
             if info["socket"] == client["socket"]:
-                del self.clients[ip]
-                self.broadcast_user_list()
+                self.remove_client(key)
                 break
 
-    def broadcast_user_list(self):
-        user_list = [
-            {"ip": ip, "nickname": info["nickname"]}
-            for ip, info in self.clients.items()
+    # 停止接受新连接，监听socket保持打开：热重启时新进程还要继续使用它
+    def stop_accepting(self):
+        self.accepting = False
+        self.accept_thread.join()
+
+    def resume_accepting(self):
+        self.draining = False
+        self.accepting = True
+        self.accept_thread = threading.Thread(
+            target=self.accept_connections, daemon=True
+        )
+        self.accept_thread.start()
+
+    # 排空：停止接受连接，通知每个客户端在建议的延迟后重连，等发送队列写完再断开
+    def drain(self, reason="服务器正在重启"):
+        if self.accepting:
+            self.stop_accepting()
+        self.draining = True
+        with self.clients_lock:
+            clients = list(self.clients.items())
+        logger.info("开始排空 %d 个连接", len(clients))
+        for key, client in clients:
+            delay = round(random.uniform(0, self.reconnect_window), 1)
+            self.send_to_client(
+                key, {"type": "reconnect", "delay": delay, "reason": reason}
+            )
+            # 发送线程写完队列中剩余的帧后退出
+            try:
+                client["outbound"].put_nowait(None)
+            except queue.Full:
+                pass
+        deadline = time.monotonic() + self.drain_timeout
+        for key, client in clients:
+            client["writer"].join(max(0, deadline - time.monotonic()))
+            self.remove_client(key)
+        # 写入 gzip 结束标记，否则回放工具读不完录制文件
+        if self.recorder:
+            self.recorder.close()
+        logger.info("排空完成")
+
+    def _park(self, key, buffer):
+        with self.park_cond:
+            self.parked[key] = buffer
+            self.park_cond.notify_all()
+
+    # 连接交接：让读线程在帧边界处暂停，写完发送队列后把连接从本进程摘下
+    # 返回 [(key, client, 未处理完的缓冲)]；超时仍未暂停（例如正在传文件）或发送队列
+    # 没写完的连接留在本进程，由 drain 处理
+    def detach_connections(self, timeout):
+        self.parking.set()
+        deadline = time.monotonic() + timeout
+        with self.park_cond:
+            while True:
+                pending = [key for key in list(self.clients) if key not in self.parked]
+                remaining = deadline - time.monotonic()
+                if not pending or remaining <= 0:
+                    break
+                self.park_cond.wait(remaining)
+            parked = dict(self.parked)
+        self.draining = True
+
+        detached = []
+        unflushed = 0
+        for key, buffer in parked.items():
+            with self.clients_lock:
+                client = self.clients.get(key)
+            if client is None:
+                continue
+            try:
+                client["outbound"].put_nowait(None)
+            except queue.Full:
+                pass
+            client["writer"].join(max(0, deadline - time.monotonic()))
+            if client["writer"].is_alive():
+                # 发送线程还在写，交出去会和新进程同时写同一个socket，留给 drain 断开
+                unflushed += 1
+                continue
+            if self._pop_client(key) is None:
+                continue
+            self.idle_wheel.cancel(key)
+            session_id = client["session_id"]
+            if session_id is not None and self.session_keys.get(session_id) == key:
+                self.session_keys.pop(session_id, None)
+            detached.append((key, client, buffer))
+        logger.info(
+            "已暂停 %d 个连接，%d 个未能暂停，%d 个发送队列未写完",
+            len(detached),
+            len(pending),
+            unflushed,
+        )
+        return detached
+
+    # 交接失败时恢复服务：重新接管暂停的连接并继续接受新连接
+    def reattach_connections(self, detached):
+        self.parking.clear()
+        reattached = {key for key, _, _ in detached}
+        with self.park_cond:
+            stranded = [key for key in self.parked if key not in reattached]
+            self.parked.clear()
+        # 已暂停但没有交出的连接，读线程已经退出，只能断开让客户端重连
+        for key in stranded:
+            self.remove_client(key)
+        for key, client, buffer in detached:
+            self.add_connection(
+                client["socket"],
+                key,
+                client["ip"],
+                buffer,
+                client["nickname"],
+                client["session_id"],
+                client["rooms"],
+            )
+        self.resume_accepting()
+
+    # 热重启时交给新进程的状态：纪元、序号、历史和会话去重位置
+    def export_state(self):
+        with self.seq_lock:
+            history = list(self.history)
+            seq = self.seq
+        with self.rooms_lock:
+            rooms = {room: list(entry["history"]) for room, entry in self.rooms.items()}
+        with self.sessions_lock:
+            sessions = [
+                [session_id, session["last_client_seq"]]
+                for session_id, session in self.sessions.items()
+            ]
+        return {
+            "epoch": self.epoch,
+            "seq": seq,
+            "history": history,
+            "rooms": rooms,
+            "sessions": sessions,
+        }
+
+    def restore_state(self, state):
+        self.epoch = state["epoch"]
+        self.seq = state["seq"] + HANDOFF_SEQ_GAP
+        self.history.extend(state["history"])
+        with self.rooms_lock:
+            for room, history in state["rooms"].items():
+                self._get_room(room)["history"].extend(history)
+        with self.sessions_lock:
+            for session_id, last_client_seq in state["sessions"]:
+                self.sessions[session_id] = {"last_client_seq": last_client_seq}
+
+    def _local_users(self):
+        return [
+            {"ip": info["ip"], "nickname": info["nickname"]}
+            for info in list(self.clients.values())
         ]
-        message = {"type": "user_list", "users": user_list}
-        for client in self.clients.values():
-            client["socket"].send(json.dumps(message).encode())
+
+    # 运行状态快照，供 /admin/status 和附加的控制台使用
+    def status(self):
+        with self.rooms_lock:
+            rooms = {room: len(entry["members"]) for room, entry in self.rooms.items()}
+        return {
+            "files": self.file_store.stats(),
+            "port": self.port,
+            "epoch": self.epoch,
+            "seq": self.seq,
+            "uptime": time.time() - self.started_at,
+            "connections": len(self.clients),
+            "users": self._user_list_message()["users"],
+            "rooms": rooms,
+            "profiling": self.profiler.enabled,
+            "draining": self.draining,
+        }
+
+    def _user_list_message(self):
+        users = self._local_users() + self.remote_users
+        if self.federation is not None:
+            users += self.federation.remote_users()
+        return {"type": "user_list", "users": users}
+
+    def broadcast_user_list(self):
+        # 排空时连接会逐个断开，不必每断开一个就广播一次
+        if self.draining:
+            return
+        if self.federation is not None:
+            self.federation.publish_presence(self._local_users())
+        if self.bus is not None:
+            # 由总线汇总所有进程的在线用户后再回调 update_remote_users
+            self.bus.publish_presence(self._local_users())
+        else:
+            self.broadcast(self._user_list_message())
+
+    # 其他工作进程的在线用户发生变化
+    def update_remote_users(self, users):
+        self.remote_users = users
+        self.remote_nicknames = {user["nickname"] for user in users}
+        self.broadcast(self._user_list_message())
 
 
 class WebHandler(BaseHTTPRequestHandler):
+    # 访问日志走日志管道，而不是直接写 stderr
+    def log_message(self, format, *args):
+        logger.debug("%s %s", self.address_string(), format % args)
+
     def do_GET(self):
-        if self.path == "/":
+        path = urlparse(self.path).path
+        if path == "/":
             self.send_response(200)
             self.send_header("Content-type", "text/html; charset=utf-8")
             self.end_headers()
@@ -205,6 +1114,9 @@ class WebHandler(BaseHTTPRequestHandler):
                     <button onclick="sendMessage()" style="width:25%;">发送</button>
                     <script>
                         let userNickname = '匿名用户';
+                        // 通过 /?room=房间名 进入指定房间，不带参数时为大厅
+                        const room = new URLSearchParams(location.search).get('room') || '';
+                        if (room) document.title += ' - ' + room;
                         
                         function setNickname() {
                             const input = document.getElementById('nickname');
@@ -225,7 +1137,6 @@ class WebHandler(BaseHTTPRequestHandler):
                                     parsedMsg.nickname = '系统消息';
                                 }
                                 const div = document.getElementById('messages');
-                                const parsedMsg = JSON.parse(msg);
                                 div.innerHTML += '<div>' + formatMessage(parsedMsg) + '</div>';
                                 div.scrollTop = div.scrollHeight;
                             } catch(e) {
@@ -238,7 +1149,8 @@ class WebHandler(BaseHTTPRequestHandler):
                             const input = document.getElementById('message');
                             const formData = new URLSearchParams({
                                 message: input.value,
-                                nickname: userNickname
+                                nickname: userNickname,
+                                room: room
                             });
                             
                             fetch('/send', {
@@ -250,7 +1162,7 @@ class WebHandler(BaseHTTPRequestHandler):
                         }
                         
                         // 实时消息推送
-                        const eventSource = new EventSource('/stream');
+                        const eventSource = new EventSource('/stream?room=' + encodeURIComponent(room));
                         eventSource.onmessage = function(e) {
                             updateMessages(e.data);
                         };
@@ -260,30 +1172,130 @@ class WebHandler(BaseHTTPRequestHandler):
             """
             self.wfile.write(html_content.encode("utf-8"))
 
-        elif self.path == "/stream":
+        elif path == "/stream":
             self.send_response(200)
             self.send_header("Content-type", "text/event-stream")
             self.send_header("Cache-Control", "no-cache")
             self.end_headers()
-            # 添加消息队列监听
-            while True:
-                msg = self.server.network.get_web_message()
-                if msg:
+            # 每个订阅者有自己的消息队列，阻塞等待而不是轮询；?room= 只订阅指定房间
+            network = self.server.network
+            room = parse_qs(urlparse(self.path).query).get("room", [""])[0] or None
+            subscriber = network.subscribe_web(room)
+            try:
+                while True:
                     try:
+                        msg = subscriber.get(timeout=15)
                         self.wfile.write(f"data: {msg}\n\n".encode("utf-8"))
-                        self.wfile.flush()
-                    except BrokenPipeError:
-                        break
+                    except queue.Empty:
+                        # 定期发送注释行，及时发现已断开的订阅者
+                        self.wfile.write(b": keepalive\n\n")
+                    self.wfile.flush()
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+            finally:
+                network.unsubscribe_web(subscriber, room)
+        elif path.startswith("/admin/"):
+            self.handle_admin()
+        elif path == "/metrics":
+            # 指标包含连接数、文件和信箱用量等运维信息，与管理接口同样鉴权
+            if not self.is_admin():
+                self.send_error(403)
+                return
+            body = self.server.network.metrics.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        else:
+            self.send_error(404)
+
+    # 管理员下载已接收的文件，同时刷新它在 LRU 中的位置
+    def send_stored_file(self, name):
+        file_path = None
+        if name == os.path.basename(name):
+            file_path = self.server.network.file_store.open_path(name)
+        try:
+            f = open(file_path, "rb") if file_path else None
+        except OSError:
+            f = None
+        if f is None:
+            self.send_error(404)
+            return
+        with f:
+            self.send_response(200)
+            self.send_header("Content-type", "application/octet-stream")
+            self.send_header("Content-Length", str(os.fstat(f.fileno()).st_size))
+            self.end_headers()
+            shutil.copyfileobj(f, self.wfile)
+
+    # 管理接口：配置了 admin_token 时校验令牌，否则只允许本机访问
+    def is_admin(self):
+        token = self.server.network.admin_token
+        if not token:
+            return self.client_address[0] in ("127.0.0.1", "::1")
+        query = parse_qs(urlparse(self.path).query)
+        supplied = self.headers.get("X-Admin-Token") or query.get("token", [""])[0]
+        return hmac.compare_digest(supplied.encode(), token.encode())
+
+    def send_json(self, data, status=200):
+        body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def handle_admin(self):
+        if not self.is_admin():
+            self.send_error(403)
+            return
+        parsed = urlparse(self.path)
+        query = parse_qs(parsed.query)
+        profiler = self.server.network.profiler
+
+        if parsed.path == "/admin/status":
+            self.send_json(self.server.network.status())
+        elif parsed.path == "/admin/logs":
+            self.send_json(recent_logs(int(query.get("since", ["0"])[0])))
+        elif parsed.path == "/admin/profile" and self.command == "POST":
+            seconds = float(query.get("seconds", ["30"])[0])
+            started = profiler.start(seconds)
+            self.send_json({"started": started, "seconds": seconds})
+        elif parsed.path == "/admin/profile":
+            self.send_json({"running": profiler.enabled, "reports": profiler.reports()})
+        elif parsed.path.startswith("/admin/reports/"):
+            report_path = profiler.report_path(parsed.path.rsplit("/", 1)[1])
+            if report_path is None:
+                self.send_error(404)
+                return
+            with open(report_path, "rb") as f:
+                body = f.read()
+            self.send_response(200)
+            self.send_header("Content-type", "text/plain; charset=utf-8")
+            self.send_header(
+                "Content-Disposition",
+                f'attachment; filename="{os.path.basename(report_path)}"',
+            )
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        elif parsed.path.startswith("/admin/files/"):
+            # 接收的文件可能是私聊发送的，只允许管理员下载
+            self.send_stored_file(unquote(parsed.path[len("/admin/files/") :]))
         else:
             self.send_error(404)
 
     def do_POST(self):
-        if self.path == "/send":
+        if self.path.startswith("/admin/"):
+            self.handle_admin()
+        elif self.path == "/send":
             content_length = int(self.headers["Content-Length"])
             post_data = parse_qs(self.rfile.read(content_length).decode())
 
             message = post_data.get("message", [""])[0]
             nickname = post_data.get("nickname", ["匿名用户"])[0]
+            room = post_data.get("room", [""])[0]
             if message:
                 # 生成网页消息格式
                 web_message = {
@@ -295,6 +1307,8 @@ class WebHandler(BaseHTTPRequestHandler):
                     "receiver": "all",
                     "source": "web",  # 新增来源标识
                 }
+                if room:
+                    web_message["room"] = room
                 # 通过服务器广播
                 self.server.network.broadcast_message(web_message)
 
@@ -303,52 +1317,84 @@ class WebHandler(BaseHTTPRequestHandler):
 
 
 class EnhancedServerNetwork(ServerNetwork):
-    def __init__(self, *args):
-        print(f"服务器已启动在 {args[1]} 端口")
-        super().__init__(*args)
-        self.web_message_queue = []
+    def __init__(
+        self,
+        *args,
+        web_host="0.0.0.0",
+        web_port=8081,
+        admin_token=None,
+        web_socket=None,
+        **kwargs,
+    ):
+        logger.info("服务器已启动在 %s 端口", args[1])
+        # 网页订阅者按房间分组：{room 或 None（大厅）: set(queue)}
+        self.web_subscribers = {}
         self.web_message_lock = threading.Lock()
+        self.admin_token = admin_token
+        self.reuse_port = kwargs.get("reuse_port", False)
+        super().__init__(*args, **kwargs)
+        self.metrics.callback_gauge(
+            "im_sse_subscribers",
+            "网页端 SSE 订阅者数量",
+            lambda: sum(map(len, list(self.web_subscribers.values()))),
+        )
         # 启动HTTP服务器
-        self.start_web_server(8081)  # 使用不同端口
+        self.start_web_server(web_host, web_port, web_socket)  # 使用不同端口
 
-    def start_web_server(self, port):
-        def run_server():
-            server = ThreadingHTTPServer(("0.0.0.0", port), WebHandler)
-            server.network = self  # 绑定网络实例
-            server.serve_forever()
+    # web_socket 为热重启时旧进程交过来的监听socket
+    def start_web_server(self, host, port, web_socket=None):
+        server = ThreadingHTTPServer((host, port), WebHandler, bind_and_activate=False)
+        if web_socket is not None:
+            server.socket.close()
+            server.socket = web_socket
+        else:
+            server.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            if self.reuse_port:
+                server.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            server.server_bind()
+            server.server_activate()
+        server.network = self  # 绑定网络实例
+        self.web_server = server
+        self._serve_web()
 
-        web_thread = threading.Thread(target=run_server, daemon=True)
+    def _serve_web(self):
+        web_thread = threading.Thread(target=self.web_server.serve_forever, daemon=True)
         web_thread.start()
 
-    # 线程安全的广播方法
+    # 网页端口与聊天端口一起停止/恢复接受连接
+    def stop_accepting(self):
+        super().stop_accepting()
+        self.web_server.shutdown()
+
+    def resume_accepting(self):
+        super().resume_accepting()
+        self._serve_web()
+
+    # 网页端发来的消息与客户端消息走同一条投递路径
     def broadcast_message(self, message):
-        with threading.Lock():
-            # 推送到网页消息队列
-            if message.get("type") == "message":
-                formatted_msg = json.dumps(
-                    {
-                        "timestamp": message["timestamp"],
-                        "nickname": message["nickname"],
-                        "content": message["content"],
-                        "source": "client" if message.get("source") != "web" else "web",
-                    },
-                    ensure_ascii=False,
-                )
-                self.push_web_message(formatted_msg)
-
-            # 客户端发送逻辑
-            for ip, client in list(self.clients.items()):
-                try:
-                    data = json.dumps(message, ensure_ascii=False).encode("utf-8")
-                    client["socket"].send(data)
-                except Exception as e:
-                    print(f"网页消息发送失败至 {ip}: {str(e)}")
-                    del self.clients[ip]
-
-    def push_web_message(self, msg):
+        with self.profiler.span("broadcast_message"):
+            self.route_message(message)
+
+    # 推送给该房间（room 为 None 时为大厅）的网页订阅者；订阅者积压过多时丢弃消息，不阻塞消息投递
+    def push_web_message(self, msg, room=None):
+        with self.web_message_lock:
+            subscribers = list(self.web_subscribers.get(room, ()))
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait(msg)
+            except queue.Full:
+                pass
+
+    def subscribe_web(self, room=None):
+        subscriber = queue.Queue(maxsize=self.outbound_queue_size)
         with self.web_message_lock:
-            self.web_message_queue.append(msg)
+            self.web_subscribers.setdefault(room, set()).add(subscriber)
+        return subscriber
 
-    def get_web_message(self):
+    def unsubscribe_web(self, subscriber, room=None):
         with self.web_message_lock:
-            return self.web_message_queue.pop(0) if self.web_message_queue else None
+            subscribers = self.web_subscribers.get(room)
+            if subscribers is not None:
+                subscribers.discard(subscriber)
+                if not subscribers:
+                    del self.web_subscribers[room]
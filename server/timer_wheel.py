@@ -0,0 +1,66 @@
+import math
+import threading
+import time
+
+
+class TimerWheel:
+    """哈希时间轮：按到期刻度把键散列到槽中
+
+    每个刻度只检查当前槽里的键，与总会话数无关。续期只更新到期时间，
+    不移动键（惰性续期），因此心跳频繁时续期也是 O(1)。
+    """
+
+    def __init__(self, tick=1.0, slots=512):
+        self.tick = tick
+        self.slots = [set() for _ in range(slots)]
+        self.deadlines = {}  # {key: 到期刻度}
+        self.lock = threading.Lock()
+        self.current_tick = self._tick_of(time.monotonic())
+
+    def _tick_of(self, now):
+        return int(now / self.tick)
+
+    # 安排或续期：delay 秒后到期
+    def schedule(self, key, delay):
+        deadline = self._tick_of(time.monotonic()) + max(
+            1, math.ceil(delay / self.tick)
+        )
+        with self.lock:
+            old_deadline = self.deadlines.get(key)
+            if old_deadline is None or deadline < old_deadline:
+                # 提前到期时必须立即放入新槽，推迟到期则等旧槽经过时再搬
+                self.slots[deadline % len(self.slots)].add(key)
+            self.deadlines[key] = deadline
+
+    touch = schedule
+
+    # 取消只删除到期时间，槽中的键在下次经过时清理
+    def cancel(self, key):
+        with self.lock:
+            self.deadlines.pop(key, None)
+
+    def __len__(self):
+        return len(self.deadlines)
+
+    # 推进到当前时间，返回已到期的键
+    def advance(self, now=None):
+        target = self._tick_of(time.monotonic() if now is None else now)
+        expired = []
+        with self.lock:
+            while self.current_tick < target:
+                self.current_tick += 1
+                index = self.current_tick % len(self.slots)
+                slot = self.slots[index]
+                for key in list(slot):
+                    deadline = self.deadlines.get(key)
+                    if deadline is None:
+                        slot.discard(key)
+                    elif deadline <= self.current_tick:
+                        slot.discard(key)
+                        del self.deadlines[key]
+                        expired.append(key)
+                    elif deadline % len(self.slots) != index:
+                        # 被续期过的键搬到新的到期槽
+                        slot.discard(key)
+                        self.slots[deadline % len(self.slots)].add(key)
+        return expired
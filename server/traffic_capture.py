@@ -0,0 +1,124 @@
+import gzip
+import hashlib
+import json
+import os
+import queue
+import threading
+import time
+
+# 录制文件格式：gzip 压缩的 JSON 行，每行 [相对时间, 连接编号, 事件, 数据]
+# 事件：open 建立连接 / frame 收到的帧 / file_data 文件内容字节数 / close 断开
+CAPTURE_VERSION = 1
+
+
+class TrafficRecorder:
+    """把入站帧按时间戳录制到压缩文件，供 tools/traffic_replay.py 回放
+
+    写文件在后台线程进行，处理线程只做一次入队。文件内容不录制，只记录字节数。
+    """
+
+    def __init__(self, path, anonymize=False):
+        self.path = path
+        self.anonymize = anonymize
+        # 每次录制使用随机盐，匿名后的昵称无法反查
+        self.salt = os.urandom(8).hex()
+        self.started = time.monotonic()
+        self.conn_ids = {}
+        self.next_conn_id = 1
+        self.lock = threading.Lock()
+        self.events = queue.Queue()
+        self.writer_thread = threading.Thread(target=self._write_events, daemon=True)
+        self.writer_thread.start()
+        self.events.put(
+            {"version": CAPTURE_VERSION, "anonymized": anonymize, "time": time.time()}
+        )
+
+    def _conn_id(self, key, create=False):
+        with self.lock:
+            conn_id = self.conn_ids.get(key)
+            if conn_id is None and create:
+                conn_id = self.next_conn_id
+                self.next_conn_id += 1
+                self.conn_ids[key] = conn_id
+            return conn_id
+
+    def _record(self, key, event, data=None, create=False):
+        conn_id = self._conn_id(key, create)
+        if conn_id is None:
+            return
+        offset = round(time.monotonic() - self.started, 6)
+        self.events.put([offset, conn_id, event, data])
+
+    def record_open(self, key):
+        self._record(key, "open", create=True)
+
+    def record_frame(self, key, frame):
+        if self.anonymize:
+            frame = self._anonymize(frame)
+        self._record(key, "frame", frame)
+
+    def record_file_data(self, key, size):
+        self._record(key, "file_data", size)
+
+    def record_close(self, key):
+        self._record(key, "close")
+        with self.lock:
+            self.conn_ids.pop(key, None)
+
+    def _hash(self, value):
+        digest = hashlib.sha1((self.salt + str(value)).encode("utf-8")).hexdigest()
+        return f"user-{digest[:8]}"
+
+    # 昵称等标识替换为稳定的哈希，内容替换为等长占位符，保留流量形状
+    def _anonymize(self, frame):
+        frame = dict(frame)
+        for field in ("nickname", "session_id", "sender_ip", "ip"):
+            if field in frame:
+                frame[field] = self._hash(frame[field])
+        if frame.get("receiver") not in (None, "all"):
+            frame["receiver"] = self._hash(frame["receiver"])
+        if isinstance(frame.get("content"), str):
+            frame["content"] = "x" * len(frame["content"])
+        if "file_name" in frame:
+            extension = os.path.splitext(frame["file_name"])[1]
+            frame["file_name"] = self._hash(frame["file_name"]) + extension
+        return frame
+
+    def _write_events(self):
+        last_flush = time.monotonic()
+        with gzip.open(self.path, "wt", encoding="utf-8") as f:
+            while True:
+                try:
+                    event = self.events.get(timeout=1.0)
+                except queue.Empty:
+                    event = ()
+                if event is None:
+                    break
+                if event:
+                    f.write(json.dumps(event, ensure_ascii=False) + "\n")
+                # 每秒最多刷新一次，兼顾压缩率和异常退出时丢失的数据量
+                if time.monotonic() - last_flush >= 1.0:
+                    f.flush()
+                    last_flush = time.monotonic()
+
+    def close(self):
+        self.events.put(None)
+        self.writer_thread.join()
+
+
+def read_capture(path):
+    """读取录制文件，返回 (文件头, 事件迭代器)"""
+    f = gzip.open(path, "rt", encoding="utf-8")
+    header = json.loads(f.readline())
+
+    def events():
+        with f:
+            try:
+                for line in f:
+                    if line.strip():
+                        yield json.loads(line)
+            except EOFError:
+                # 进程异常退出时文件没有结束标记，读到最后一次刷新的位置为止
+                return
+
+    return header, events()
@@ -0,0 +1,500 @@
+"""无界面压测工具：模拟多个 socket 客户端和网页客户端，测量服务器吞吐和延迟
+
+用法示例：
+    python tools/load_generator.py --spawn --clients 200 --web-clients 20 \\
+        --rate 2 --duration 30 --output bench.json
+"""
+
+import argparse
+import http.client
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from urllib.parse import urlencode
+
+try:
+    import psutil
+except ImportError:  # 没有 psutil 时退回读取 /proc
+    psutil = None
+
+FRAME_DELIMITER = b"<END_OF_JSON>"
+# 压测消息内容前缀：bench|发送者|发送时间
+BENCH_PREFIX = "bench|"
+
+SERVER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "server")
+SPAWN_SCRIPT = """
+import sys, time
+sys.path.insert(0, sys.argv[3])
+from server_network import EnhancedServerNetwork
+EnhancedServerNetwork(sys.argv[1], int(sys.argv[2]), None, web_port=int(sys.argv[4]))
+while True:
+    time.sleep(3600)
+"""
+
+
+def encode_frame(message):
+    return json.dumps(message, ensure_ascii=False).encode("utf-8") + FRAME_DELIMITER
+
+
+def now_str():
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(len(sorted_values) * p))
+    return sorted_values[index]
+
+
+class Stats:
+    """所有模拟客户端共享的统计数据"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.latencies = []
+        self.file_bytes = 0
+        self.file_seconds = 0.0
+
+    def incr(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def record_latency(self, seconds):
+        with self.lock:
+            self.latencies.append(seconds)
+
+    def record_file(self, size, seconds):
+        with self.lock:
+            self.file_bytes += size
+            self.file_seconds += seconds
+
+
+class SocketClient:
+    """模拟一个桌面客户端：按配置的速率发送群聊、私聊、昵称更新和文件
+
+    nicknames 是所有模拟客户端当前昵称的共享列表，私聊从中选接收者，改名后仍能送达。
+    """
+
+    def __init__(self, index, args, stats, stop_event, nicknames):
+        self.index = index
+        self.args = args
+        self.stats = stats
+        self.stop_event = stop_event
+        self.nicknames = nicknames
+        self.nickname = nicknames[index]
+        self.client_seq = 0
+        # 心跳线程和发送线程共用连接，文件内容也不能被心跳打断
+        self.send_lock = threading.Lock()
+        self.file_ack = threading.Event()
+        self.file_rejected = False
+        self.sock = None
+
+    def run(self):
+        try:
+            self.sock = socket.create_connection(
+                (self.args.host, self.args.port), timeout=10
+            )
+            self.sock.settimeout(None)
+            self.send(
+                {
+                    "type": "hello",
+                    "session_id": f"{self.nickname}-{os.getpid()}",
+                    "nickname": self.nickname,
+                }
+            )
+            self.stats.incr("connected")
+        except OSError:
+            self.stats.incr("connect_errors")
+            return
+
+        threading.Thread(target=self.receive, daemon=True).start()
+        try:
+            self.drive()
+        except OSError:
+            self.stats.incr("send_errors")
+        finally:
+            self.sock.close()
+
+    def send(self, message):
+        with self.send_lock:
+            self._send(message)
+
+    def _send(self, message):
+        data = encode_frame(message)
+        self.sock.sendall(data)
+        self.stats.incr("bytes_out", len(data))
+
+    # 按 welcome 下发的间隔发送心跳，只收不发的客户端也不会被空闲超时断开
+    def send_heartbeats(self, interval):
+        while not self.stop_event.wait(interval):
+            try:
+                self.send({"type": "ping"})
+            except OSError:
+                break
+
+    def receive(self):
+        buffer = b""
+        try:
+            while True:
+                data = self.sock.recv(65536)
+                if not data:
+                    break
+                self.stats.incr("bytes_in", len(data))
+                buffer += data
+                while FRAME_DELIMITER in buffer:
+                    frame, buffer = buffer.split(FRAME_DELIMITER, 1)
+                    self.handle(json.loads(frame.decode("utf-8")))
+        except (OSError, ValueError):
+            pass
+
+    def handle(self, message):
+        msg_type = message.get("type")
+        self.stats.incr(f"recv_{msg_type}")
+        if msg_type == "welcome":
+            threading.Thread(
+                target=self.send_heartbeats,
+                args=(message.get("heartbeat_interval", 15),),
+                daemon=True,
+            ).start()
+        elif msg_type in ("file_ack", "file_reject"):
+            # 服务器拒绝（配额不足）时同样立即结束等待，只是不发送文件内容
+            self.file_rejected = msg_type == "file_reject"
+            self.file_ack.set()
+        elif msg_type == "message":
+            content = message.get("content", "")
+            if content.startswith(BENCH_PREFIX):
+                sent_at = float(content.split("|")[2])
+                self.stats.record_latency(time.time() - sent_at)
+
+    # 按泊松过程安排各类事件，各自的速率都是每客户端每秒的次数
+    def drive(self):
+        args = self.args
+        rates = {
+            "chat": args.rate,
+            "update": args.update_rate,
+            "file": args.file_rate,
+        }
+        total_rate = sum(rates.values())
+        if total_rate <= 0:
+            self.stop_event.wait()
+            return
+        kinds = list(rates)
+        weights = [rates[kind] for kind in kinds]
+        while not self.stop_event.is_set():
+            if self.stop_event.wait(random.expovariate(total_rate)):
+                break
+            kind = random.choices(kinds, weights)[0]
+            if kind == "chat":
+                self.send_chat()
+            elif kind == "update":
+                self.nickname = f"bench{self.index}-{random.randint(0, 999)}"
+                self.nicknames[self.index] = self.nickname
+                self.send(
+                    {"type": "user_update", "nickname": self.nickname, "ip": "bench"}
+                )
+                self.stats.incr("sent_user_update")
+            else:
+                self.send_file()
+
+    def send_chat(self):
+        self.client_seq += 1
+        private = random.random() < self.args.private_ratio
+        receiver = random.choice(self.nicknames) if private else "all"
+        self.send(
+            {
+                "type": "message",
+                "sender_ip": "bench",
+                "nickname": self.nickname,
+                "timestamp": now_str(),
+                "content": f"{BENCH_PREFIX}{self.index}|{time.time():.6f}",
+                "receiver": receiver,
+                "client_seq": self.client_seq,
+            }
+        )
+        self.stats.incr("sent_private" if private else "sent_chat")
+
+    def send_file(self):
+        size = self.args.file_size
+        self.file_ack.clear()
+        started = time.perf_counter()
+        with self.send_lock:
+            self._send(
+                {
+                    "type": "file",
+                    "sender_ip": "bench",
+                    "nickname": self.nickname,
+                    "timestamp": now_str(),
+                    "file_name": f"bench_{self.index}_{self.client_seq}.bin",
+                    "file_size": size,
+                    "receiver": "all",
+                }
+            )
+            if not self.file_ack.wait(10):
+                self.stats.incr("file_errors")
+                return
+            if self.file_rejected:
+                self.stats.incr("file_rejected")
+                return
+            chunk = os.urandom(min(size, 65536))
+            sent = 0
+            while sent < size:
+                part = chunk[: size - sent]
+                self.sock.sendall(part)
+                sent += len(part)
+        self.stats.record_file(size, time.perf_counter() - started)
+        self.stats.incr("sent_file")
+
+
+class WebClient:
+    """模拟一个网页客户端：订阅 SSE 消息流并按速率通过 /send 发言"""
+
+    def __init__(self, index, args, stats, stop_event):
+        self.index = index
+        self.args = args
+        self.stats = stats
+        self.stop_event = stop_event
+
+    def run(self):
+        threading.Thread(target=self.subscribe, daemon=True).start()
+        if self.args.web_rate <= 0:
+            return
+        while not self.stop_event.wait(random.expovariate(self.args.web_rate)):
+            body = urlencode(
+                {
+                    "message": f"{BENCH_PREFIX}web{self.index}|{time.time():.6f}",
+                    "nickname": f"web{self.index}",
+                }
+            )
+            try:
+                conn = http.client.HTTPConnection(
+                    self.args.host, self.args.web_port, timeout=10
+                )
+                conn.request(
+                    "POST",
+                    "/send",
+                    body,
+                    {"Content-Type": "application/x-www-form-urlencoded"},
+                )
+                conn.getresponse().read()
+                conn.close()
+                self.stats.incr("sent_web")
+            except OSError:
+                self.stats.incr("web_errors")
+
+    def subscribe(self):
+        try:
+            conn = http.client.HTTPConnection(self.args.host, self.args.web_port)
+            conn.request("GET", "/stream")
+            response = conn.getresponse()
+            self.stats.incr("sse_connected")
+            while not self.stop_event.is_set():
+                line = response.fp.readline()
+                if not line:
+                    break
+                if not line.startswith(b"data: "):
+                    continue
+                self.stats.incr("recv_sse")
+                content = json.loads(line[6:].decode("utf-8")).get("content", "")
+                if content.startswith(BENCH_PREFIX):
+                    sent_at = float(content.split("|")[2])
+                    self.stats.record_latency(time.time() - sent_at)
+        except (OSError, ValueError):
+            self.stats.incr("sse_errors")
+
+
+class ResourceSampler:
+    """每秒采样一次服务器进程的 CPU 和常驻内存"""
+
+    def __init__(self, pid, stop_event):
+        self.pid = pid
+        self.stop_event = stop_event
+        self.samples = []
+
+    def _read(self):
+        if psutil is not None:
+            process = psutil.Process(self.pid)
+            times = process.cpu_times()
+            return times.user + times.system, process.memory_info().rss
+        with open(f"/proc/{self.pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        ticks = os.sysconf("SC_CLK_TCK")
+        cpu = (int(fields[11]) + int(fields[12])) / ticks
+        with open(f"/proc/{self.pid}/statm") as f:
+            rss = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        return cpu, rss
+
+    def run(self):
+        try:
+            last_cpu, _ = self._read()
+            last_time = time.monotonic()
+            while not self.stop_event.wait(1.0):
+                cpu, rss = self._read()
+                now = time.monotonic()
+                self.samples.append(
+                    {
+                        "cpu_percent": 100.0 * (cpu - last_cpu) / (now - last_time),
+                        "rss_bytes": rss,
+                    }
+                )
+                last_cpu, last_time = cpu, now
+        except (OSError, ImportError) as e:
+            print(f"无法采样服务器资源: {str(e)}")
+
+    def summary(self):
+        if not self.samples:
+            return {}
+        cpu = [sample["cpu_percent"] for sample in self.samples]
+        rss = [sample["rss_bytes"] for sample in self.samples]
+        return {
+            "cpu_percent_avg": sum(cpu) / len(cpu),
+            "cpu_percent_max": max(cpu),
+            "rss_bytes_max": max(rss),
+            "rss_bytes_last": rss[-1],
+        }
+
+
+def spawn_server(args):
+    process = subprocess.Popen(
+        [
+            sys.executable,
+            "-c",
+            SPAWN_SCRIPT,
+            args.host,
+            str(args.port),
+            SERVER_DIR,
+            str(args.web_port),
+        ],
+        # 在临时目录运行，收到的压测文件不会留在仓库里
+        cwd=tempfile.mkdtemp(prefix="im_bench_"),
+        stdout=subprocess.DEVNULL,
+    )
+    # 等待端口可连接
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection((args.host, args.port), timeout=1).close()
+            return process
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("服务器启动超时")
+
+
+def run_benchmark(args):
+    stats = Stats()
+    stop_event = threading.Event()
+    server_process = spawn_server(args) if args.spawn else None
+    server_pid = server_process.pid if server_process else args.server_pid
+
+    sampler = None
+    if server_pid:
+        sampler = ResourceSampler(server_pid, stop_event)
+        threading.Thread(target=sampler.run, daemon=True).start()
+
+    nicknames = [f"bench{i}" for i in range(args.clients)]
+    workers = [
+        SocketClient(i, args, stats, stop_event, nicknames) for i in range(args.clients)
+    ]
+    workers += [WebClient(i, args, stats, stop_event) for i in range(args.web_clients)]
+    threads = [threading.Thread(target=w.run, daemon=True) for w in workers]
+    started = time.monotonic()
+    for thread in threads:
+        thread.start()
+        # 分散建立连接，避免瞬间挤满监听队列
+        time.sleep(args.ramp / max(1, len(threads)))
+
+    time.sleep(args.duration)
+    stop_event.set()
+    # 留出时间接收还在路上的消息
+    time.sleep(1)
+    elapsed = time.monotonic() - started
+
+    if server_process:
+        server_process.terminate()
+        server_process.wait()
+
+    with stats.lock:
+        latencies = sorted(stats.latencies)
+        counters = dict(stats.counters)
+    sent = sum(counters.get(name, 0) for name in ("sent_chat", "sent_private"))
+    sent += counters.get("sent_web", 0)
+    delivered = counters.get("recv_message", 0) + counters.get("recv_sse", 0)
+    return {
+        "label": args.label,
+        "started_at": now_str(),
+        "config": {key: value for key, value in vars(args).items() if key != "output"},
+        "elapsed_seconds": elapsed,
+        "counters": counters,
+        "throughput": {
+            "messages_sent_per_second": sent / elapsed,
+            "deliveries_per_second": delivered / elapsed,
+            "bytes_in_per_second": counters.get("bytes_in", 0) / elapsed,
+        },
+        "fanout_latency_seconds": {
+            "count": len(latencies),
+            "p50": percentile(latencies, 0.50),
+            "p99": percentile(latencies, 0.99),
+            "p999": percentile(latencies, 0.999),
+            "max": latencies[-1] if latencies else None,
+        },
+        "file_mb_per_second": (
+            stats.file_bytes / stats.file_seconds / 1e6 if stats.file_seconds else None
+        ),
+        "server_resources": sampler.summary() if sampler else {},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="即时通讯服务器压测工具")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--web-port", type=int, default=8081)
+    parser.add_argument("--clients", type=int, default=50, help="socket 客户端数量")
+    parser.add_argument("--web-clients", type=int, default=0, help="网页客户端数量")
+    parser.add_argument("--duration", type=float, default=30, help="压测时长（秒）")
+    parser.add_argument("--ramp", type=float, default=2, help="建立连接的时长（秒）")
+    parser.add_argument("--rate", type=float, default=1, help="每客户端每秒聊天消息数")
+    parser.add_argument("--private-ratio", type=float, default=0.1, help="私聊占比")
+    parser.add_argument("--update-rate", type=float, default=0.01)
+    parser.add_argument("--file-rate", type=float, default=0, help="每客户端每秒文件数")
+    parser.add_argument("--file-size", type=int, default=1024 * 1024)
+    parser.add_argument(
+        "--web-rate", type=float, default=0.5, help="每网页客户端每秒发言数"
+    )
+    parser.add_argument("--spawn", action="store_true", help="在本机启动一个被测服务器")
+    parser.add_argument(
+        "--server-pid", type=int, help="已运行服务器的进程号，用于采样资源"
+    )
+    parser.add_argument("--label", default="", help="结果标签，例如版本号")
+    parser.add_argument("--output", default="bench_results.json")
+    args = parser.parse_args()
+
+    result = run_benchmark(args)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+
+    latency = result["fanout_latency_seconds"]
+    throughput = result["throughput"]
+    print(
+        f"发送 {throughput['messages_sent_per_second']:.1f} 条/秒，"
+        f"投递 {throughput['deliveries_per_second']:.1f} 条/秒"
+    )
+    if latency["count"]:
+        print(
+            f"扇出延迟 p50={latency['p50'] * 1000:.2f}ms "
+            f"p99={latency['p99'] * 1000:.2f}ms p999={latency['p999'] * 1000:.2f}ms"
+        )
+    print(f"结果已保存到 {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+"""按录制时的节奏回放服务器流量录制文件
+
+服务器开启录制：python server/server.py --capture-path capture.jsonl.gz
+回放示例：
+    python tools/traffic_replay.py capture.jsonl.gz --port 9080 --speed 10
+--speed 1 为原速，N 为 N 倍速，0 为尽可能快。
+"""
+
+import argparse
+import json
+import os
+import queue
+import socket
+import sys
+import threading
+import time
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "server")
+)
+from traffic_capture import read_capture  # noqa: E402
+
+FRAME_DELIMITER = b"<END_OF_JSON>"
+
+
+class ReplayConnection:
+    """回放一个录制的连接；每个连接一个线程，文件上传不会阻塞其他连接"""
+
+    def __init__(self, conn_id, args, stats, stats_lock):
+        self.conn_id = conn_id
+        self.args = args
+        self.stats = stats
+        self.stats_lock = stats_lock
+        self.events = queue.Queue()
+        self.file_ack = threading.Event()
+        self.file_rejected = False
+        self.sock = None
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        try:
+            self.sock = socket.create_connection((self.args.host, self.args.port))
+        except OSError:
+            self.incr("connect_errors")
+            return
+        threading.Thread(target=self.receive, daemon=True).start()
+        while True:
+            event = self.events.get()
+            if event is None:
+                break
+            try:
+                self.send_frame(event)
+            except OSError:
+                self.incr("send_errors")
+                break
+        self.sock.close()
+
+    # 所有连接线程共用一份统计，+= 不是原子操作，需要加锁
+    def incr(self, key, amount=1):
+        with self.stats_lock:
+            self.stats[key] += amount
+
+    def send_frame(self, frame):
+        if frame.get("type") == "file":
+            self.file_ack.clear()
+        self.sock.sendall(
+            json.dumps(frame, ensure_ascii=False).encode() + FRAME_DELIMITER
+        )
+        self.incr("frames")
+        if frame.get("type") != "file":
+            return
+        # 录制中没有文件内容，用等长的零字节代替
+        if not self.file_ack.wait(10):
+            self.incr("file_errors")
+            return
+        if self.file_rejected:
+            self.incr("file_rejected")
+            return
+        remaining = frame["file_size"]
+        chunk = bytes(min(remaining, 65536))
+        while remaining > 0:
+            part = chunk[:remaining]
+            self.sock.sendall(part)
+            remaining -= len(part)
+        self.incr("file_bytes", frame["file_size"])
+
+    def receive(self):
+        buffer = b""
+        try:
+            while True:
+                data = self.sock.recv(65536)
+                if not data:
+                    break
+                buffer += data
+                while FRAME_DELIMITER in buffer:
+                    frame, buffer = buffer.split(FRAME_DELIMITER, 1)
+                    if b'"file_ack"' in frame or b'"file_reject"' in frame:
+                        # 被拒绝的上传不发送文件内容
+                        self.file_rejected = b'"file_reject"' in frame
+                        self.file_ack.set()
+                    self.incr("frames_received")
+        except OSError:
+            pass
+
+
+def replay(args):
+    header, events = read_capture(args.capture)
+    print(f"录制开始于 {time.ctime(header['time'])}，匿名化：{header['anonymized']}")
+    stats = {
+        "frames": 0,
+        "frames_received": 0,
+        "file_bytes": 0,
+        "connect_errors": 0,
+        "send_errors": 0,
+        "file_errors": 0,
+        "file_rejected": 0,
+    }
+    stats_lock = threading.Lock()
+    connections = {}
+    replayed = []
+    max_lag = 0.0
+    started = time.monotonic()
+
+    for offset, conn_id, event, data in events:
+        # 按录制时间调度，速度为0时不等待
+        if args.speed > 0:
+            target = started + offset / args.speed
+            delay = target - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                max_lag = max(max_lag, -delay)
+
+        if event == "open":
+            connections[conn_id] = ReplayConnection(conn_id, args, stats, stats_lock)
+            replayed.append(connections[conn_id])
+        elif event == "frame" and conn_id in connections:
+            connections[conn_id].events.put(data)
+        elif event == "close" and conn_id in connections:
+            connections.pop(conn_id).events.put(None)
+
+    for connection in connections.values():
+        connection.events.put(None)
+    # 等待所有连接把排队的帧发完
+    for connection in replayed:
+        connection.thread.join(args.drain_timeout)
+
+    stats["elapsed_seconds"] = time.monotonic() - started
+    stats["max_schedule_lag_seconds"] = max_lag
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="回放服务器流量录制文件")
+    parser.add_argument("capture", help="录制文件路径")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument(
+        "--speed", type=float, default=1.0, help="回放倍速，0 表示尽可能快"
+    )
+    parser.add_argument("--drain-timeout", type=float, default=10)
+    parser.add_argument("--output", help="把回放统计保存为 JSON")
+    args = parser.parse_args()
+
+    stats = replay(args)
+    print(json.dumps(stats, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(stats, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()